@@ -1,16 +1,28 @@
+import html
+import io
 import os
-import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes, ConversationHandler
 from database import (
-    get_all_users, is_admin_in_db, add_admin, remove_admin, 
-    get_all_admins, get_setting, set_setting, get_users_by_filter,
+    is_admin_in_db, add_admin, remove_admin, 
+    set_setting, count_users_by_filter, get_users_page,
     toggle_user_ban, add_group, remove_group, add_user_to_group, 
-    get_all_groups, get_users_in_group
+    get_all_groups, create_broadcast_job, get_broadcast_jobs, get_audience_index,
+    get_reachability_stats, delete_flood_ban
 )
+from audience import AudienceError, evaluate, valid_group_name, MAX_GROUP_NAME_BYTES
+from callbacks import encode, route
+import jobs
+import relay
+import progress
+import scheduling
 
 # Define states for ConversationHandler
-SELECT_TARGET, SELECT_FILE, GET_CAPTION, CONFIRM_SEND = range(4)
+SELECT_TARGET, SELECT_FILE, GET_CAPTION, CONFIRM_SEND, GET_SCHEDULE = range(5)
+
+# Users shown per page of /sudo getusers (keeps the message under Telegram's size limit)
+USERS_PAGE_SIZE = 50
 
 # For security, you should add ADMIN_ID to your .env file
 ADMIN_ID = os.getenv('ADMIN_ID')
@@ -25,6 +37,15 @@ async def is_admin(user_id):
     # Check database
     return await is_admin_in_db(user_id)
 
+async def resolve_audience(expression: str, sender_id: int) -> list:
+    """Resolves a targeting expression to a list of user IDs in ascending order, without banned users and the sender."""
+    return sorted(evaluate(expression, await get_audience_index(), exclude=(sender_id,)))
+
+def clear_broadcast_draft(context: ContextTypes.DEFAULT_TYPE):
+    """Forgets the /broadcast answers, so persistence drops them too."""
+    for key in ('broadcast_target', 'broadcast_message', 'broadcast_caption'):
+        context.user_data.pop(key, None)
+
 async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Entry point for the broadcast command: Ask for Target."""
     if not await is_admin(update.effective_user.id):
@@ -32,31 +53,34 @@ async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
     groups = await get_all_groups()
-    keyboard = [[InlineKeyboardButton("📢 All Users", callback_data="target_all")]]
+    keyboard = [[InlineKeyboardButton("📢 All Users", callback_data=encode('target', 'all'))]]
     
-    # Add group buttons in rows of 2
+    # Add group buttons in rows of 2; names from before mkgrp checked them may not fit in callback_data
+    groups = [g for g in groups if valid_group_name(g)]
     for i in range(0, len(groups), 2):
-        row = [InlineKeyboardButton(f"📁 {g}", callback_data=f"target_grp_{g}") for g in groups[i:i+2]]
+        row = [InlineKeyboardButton(f"📁 {g}", callback_data=encode('target', f"group:{g}")) for g in groups[i:i+2]]
         keyboard.append(row)
         
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await update.message.reply_text(
-        "📢 <b>Broadcast Initiation</b>\n\nPlease select the <b>Target Audience</b> for this broadcast:",
+        "📢 <b>Broadcast Initiation</b>\n\nPlease select the <b>Target Audience</b> for this broadcast, "
+        "or send an audience expression such as <code>(vip|beta) &amp; lang:es &amp; !premium</code>:",
         reply_markup=reply_markup,
         parse_mode='HTML'
     )
     return SELECT_TARGET
 
+@route('target', args=1, allow=is_admin, conversation='broadcast')
 async def receive_target(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the target selection."""
     query = update.callback_query
     await query.answer()
     
-    target = query.data
+    target = context.args[0]
     context.user_data['broadcast_target'] = target
     
-    target_display = "All Users" if target == "target_all" else f"Group: {target.replace('target_grp_', '')}"
+    target_display = "All Users" if target == "all" else f"Group: {html.escape(target.split(':', 1)[1])}"
     
     await query.edit_message_text(
         f"🎯 <b>Target:</b> {target_display}\n\nNow, please <b>send the file</b> (photo, document, video, etc.) you want to broadcast.",
@@ -64,10 +88,31 @@ async def receive_target(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return SELECT_FILE
 
+async def receive_target_expression(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handles a typed audience expression instead of a target button."""
+    expression = update.message.text.strip()
+    try:
+        recipients = await resolve_audience(expression, update.effective_user.id)
+    except AudienceError as e:
+        await update.message.reply_text(f"❌ {e}. Please send another expression or pick a button.")
+        return SELECT_TARGET
+    context.user_data['broadcast_target'] = expression
+
+    await update.message.reply_text(
+        f"🎯 <b>Target:</b> <code>{html.escape(expression)}</code> ({len(recipients)} users)\n\n"
+        f"Now, please <b>send the file</b> (photo, document, video, etc.) you want to broadcast.",
+        parse_mode='HTML'
+    )
+    return SELECT_FILE
+
 async def receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Stores the file and asks for a caption."""
-    # We can store the message object to copy it later
-    context.user_data['broadcast_message'] = update.message
+    # Only what copy_message needs, so user_data stays small and JSON-persistable
+    context.user_data['broadcast_message'] = {
+        'chat_id': update.message.chat_id,
+        'message_id': update.message.message_id,
+        'caption': update.message.caption
+    }
     
     await update.message.reply_text(
         "✅ File received!\n\nNow, please send the <b>caption</b> for this file, or type /skip to use the original caption (if any).",
@@ -79,13 +124,14 @@ async def receive_caption(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Stores the caption and asks for confirmation."""
     text = update.message.text
     if text == "/skip":
-        context.user_data['broadcast_caption'] = context.user_data['broadcast_message'].caption
+        context.user_data['broadcast_caption'] = context.user_data['broadcast_message']['caption']
     else:
         context.user_data['broadcast_caption'] = text
 
     keyboard = [
-        [InlineKeyboardButton("🚀 Send Now", callback_data="admin_send")],
-        [InlineKeyboardButton("❌ Cancel", callback_data="admin_cancel")]
+        [InlineKeyboardButton("🚀 Send Now", callback_data=encode('admin_send'))],
+        [InlineKeyboardButton("🕒 Schedule", callback_data=encode('admin_schedule'))],
+        [InlineKeyboardButton("❌ Cancel", callback_data=encode('admin_cancel'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -96,55 +142,84 @@ async def receive_caption(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return CONFIRM_SEND
 
-async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handles the confirmation buttons."""
+async def create_draft_job(context: ContextTypes.DEFAULT_TYPE, user_id: int, status_msg,
+                           scheduled_at: int = None, spread: int = 0) -> tuple:
+    """
+    Saves the /broadcast draft as a job and starts or schedules it. The job edits
+    `status_msg` with its progress. Returns (job_id, total); raises AudienceError.
+    """
+    target = context.user_data.get('broadcast_target', 'all')
+    recipients = await resolve_audience(target, user_id)
+    msg = context.user_data.get('broadcast_message')
+    caption = context.user_data.get('broadcast_caption')
+    
+    # Save the broadcast as a job so it survives restarts
+    job_id, total = await create_broadcast_job(
+        user_id, target, recipients,
+        from_chat_id=msg['chat_id'], message_id=msg['message_id'], caption=caption,
+        status_chat_id=status_msg.chat_id, status_message_id=status_msg.message_id,
+        scheduled_at=scheduled_at, spread=spread
+    )
+    await jobs.launch_job(context.bot, context.job_queue, job_id)
+    clear_broadcast_draft(context)
+    return job_id, total
+
+@route('admin_send', allow=is_admin, conversation='broadcast')
+async def admin_send(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handles the Send Now button."""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == "admin_send":
-        await query.edit_message_text("📤 Starting broadcast... please wait.")
-        
-        target = context.user_data.get('broadcast_target', 'target_all')
-        if target == "target_all":
-            users = await get_all_users()
-        else:
-            group_name = target.replace('target_grp_', '')
-            users = await get_users_in_group(group_name)
-            
-        msg = context.user_data.get('broadcast_message')
-        caption = context.user_data.get('broadcast_caption')
-        
-        success_count = 0
-        fail_count = 0
-        
-        for user_id in users:
-            try:
-                # Use copy_message to preserve the file type and content
-                await context.bot.copy_message(
-                    chat_id=user_id,
-                    from_chat_id=msg.chat_id,
-                    message_id=msg.message_id,
-                    caption=caption
-                )
-                success_count += 1
-            except Exception as e:
-                logging.error(f"Failed to send to {user_id}: {e}")
-                fail_count += 1
-        
-        await query.edit_message_text(
-            f"✅ <b>Broadcast Complete</b>\n\n"
-            f"📈 Success: {success_count}\n"
-            f"📉 Failed: {fail_count}",
-            parse_mode='HTML'
-        )
-        return ConversationHandler.END
-        
-    elif query.data == "admin_cancel":
-        await query.edit_message_text("❌ Broadcast cancelled.")
+    await query.edit_message_text("📤 Starting broadcast... please wait.")
+    try:
+        await create_draft_job(context, query.from_user.id, query.message)
+    except AudienceError as e:
+        await query.edit_message_text(f"❌ {e}. Broadcast cancelled.")
+    return ConversationHandler.END
+
+@route('admin_schedule', allow=is_admin, conversation='broadcast')
+async def admin_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handles the Schedule button: asks for a send time and spread window."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "🕒 <b>Schedule</b>\n\nSend the time to start (<code>21:30</code>, <code>+2h</code>, "
+        "<code>2026-10-18T09:00</code> or <code>now</code>), optionally followed by a window to spread "
+        "delivery over, e.g. <code>21:30 2h</code>. Times are in server time.",
+        parse_mode='HTML'
+    )
+    return GET_SCHEDULE
+
+async def receive_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Creates the scheduled job from the typed time and spread window."""
+    try:
+        scheduled_at, spread = scheduling.parse_schedule(update.message.text)
+    except scheduling.ScheduleError as e:
+        await update.message.reply_text(f"❌ {e}. Please try again or /cancel.")
+        return GET_SCHEDULE
+    status_msg = await update.message.reply_text("🕒 Saving broadcast...")
+    try:
+        job_id, total = await create_draft_job(context, update.effective_user.id, status_msg, scheduled_at, spread)
+    except AudienceError as e:
+        await status_msg.edit_text(f"❌ {e}. Broadcast cancelled.")
         return ConversationHandler.END
+    await status_msg.edit_text(
+        f"🕒 Job #{job_id} to {total} users: {scheduling.describe(scheduled_at, spread)}.\n"
+        f"Cancel it with /sudo jobs -c {job_id}"
+    )
+    return ConversationHandler.END
+
+@route('admin_cancel', conversation='broadcast')
+async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handles the Cancel button."""
+    query = update.callback_query
+    await query.answer()
+    clear_broadcast_draft(context)
+    await query.edit_message_text("❌ Broadcast cancelled.")
+    return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels the broadcast conversation."""
+    clear_broadcast_draft(context)
     await update.message.reply_text("Broadcast operation cancelled.")
     return ConversationHandler.END
 
@@ -172,18 +247,32 @@ async def sudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "📊 <b>Users:</b>\n"
             "• <code>getusers -a, --all</code> - List all users\n"
             "• <code>getusers -b, --banned</code> - List banned users\n"
-            "• <code>getusers -l, --lang &lt;code&gt;</code> - Filter by language\n\n"
+            "• <code>getusers -l, --lang &lt;code&gt;</code> - Filter by language\n"
+            "• <code>getusers -u, --unreachable</code> - Users who blocked the bot\n"
+            "• <code>stats</code> - Reachable vs. unreachable users\n\n"
             "🛡 <b>Moderation:</b>\n"
             "• <code>ban &lt;id&gt;</code> - Ban a user\n"
             "• <code>unban &lt;id&gt;</code> - Unban a user\n\n"
             "📁 <b>Groups:</b>\n"
             "• <code>mkgrp -n &lt;name&gt;</code> - Create a group\n"
             "• <code>rmgrp -n &lt;name&gt;</code> - Remove a group\n"
-            "• <code>setgrp &lt;id&gt; &lt;grp&gt;</code> - Add user to group\n\n"
+            "• <code>setgrp &lt;id&gt; &lt;grp&gt;</code> - Add user to group\n"
+            "• <code>import -n &lt;grp&gt;</code> - Add the user IDs of a replied-to CSV/TXT file\n"
+            "• <code>export -n &lt;grp&gt;</code> - Download a group's members as CSV\n\n"
             "📨 <b>Broadcast & Sessions:</b>\n"
-            "• <code>send -g &lt;grp&gt; -m &lt;msg&gt;</code> - Quick broadcast\n"
-            "• <code>send -g &lt;grp&gt;</code> - Start live session\n"
-            "• <code>send -s</code> - Stop live session"
+            "• <code>send -g &lt;audience&gt; -m &lt;msg&gt;</code> - Quick broadcast\n"
+            "• <code>send -g &lt;audience&gt; -t 21:30 -w 2h -m &lt;msg&gt;</code> - Schedule it, spread over 2h\n"
+            "• <code>send -g &lt;audience&gt;</code> - Start live session\n"
+            "• <code>send -s</code> - Stop live session\n"
+            "<i>Audience: <code>all</code>, a group name, <code>lang:es</code>, <code>premium</code>, "
+            "combined with <code>! &amp; |</code> and parentheses, e.g. <code>(vip|beta) &amp; lang:es</code> "
+            "(mixing <code>&amp;</code> and <code>|</code> needs parentheses). "
+            "Banned users and you are always excluded.</i>\n\n"
+            "🗂 <b>Broadcast Jobs:</b>\n"
+            "• <code>jobs</code> - List recent jobs\n"
+            "• <code>jobs -p &lt;id&gt;</code> - Pause a job\n"
+            "• <code>jobs -r &lt;id&gt;</code> - Resume a paused job\n"
+            "• <code>jobs -c &lt;id&gt;</code> - Cancel a job, or a scheduled one before it starts"
         )
         await update.message.reply_text(help_text, parse_mode='HTML')
         return
@@ -231,6 +320,8 @@ async def sudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         
         if "-b" in args or "--banned" in args:
             filter_type = "banned"
+        elif "-u" in args or "--unreachable" in args:
+            filter_type = "unreachable"
         elif "-l" in args or "--lang" in args:
             filter_type = "lang"
             try:
@@ -240,25 +331,39 @@ async def sudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 await update.message.reply_text("❌ Please specify a language code.")
                 return
         
-        users = await get_users_by_filter(filter_type, filter_val)
-        if not users:
+        try:
+            text, reply_markup = await build_users_page(filter_type, filter_val, 0)
+        except ValueError:
+            # The filter rides along in the page buttons' callback_data
+            await update.message.reply_text("❌ That language code is too long.")
+            return
+        if text is None:
             await update.message.reply_text("ℹ️ No users found matching criteria.")
             return
-            
-        text = f"📋 <b>User List ({filter_type})</b>\n\n"
-        for u in users[:50]: # Limit to 50 for telegram message size
-            text += f"• <code>{u['user_id']}</code> - {u['first_name']} (@{u['username'] or 'N/A'})\n"
-        
-        if len(users) > 50:
-            text += f"\n<i>... and {len(users)-50} more users.</i>"
         
-        await update.message.reply_text(text, parse_mode='HTML')
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
+
+    elif command == "stats":
+        stats = await get_reachability_stats()
+        total = stats['total'] or 1
+        await update.message.reply_text(
+            f"📊 <b>Audience Health</b>\n\n"
+            f"👥 Users: {stats['total']}\n"
+            f"✅ Reachable: {stats['reachable']} ({stats['reachable'] / total:.1%})\n"
+            f"💀 Unreachable: {stats['unreachable']} ({stats['unreachable'] / total:.1%})\n"
+            f"🚫 Banned: {stats['banned']}\n\n"
+            f"<i>Unreachable users blocked the bot or deleted their account. They are skipped by "
+            f"broadcasts until they message the bot again.</i>",
+            parse_mode='HTML'
+        )
 
     elif command in ["ban", "unban"]:
         is_ban = command == "ban"
         try:
             target_id = int(args[1])
             if await toggle_user_ban(target_id, is_ban):
+                # A manual decision replaces any automatic flood ban
+                await delete_flood_ban(target_id)
                 status = "banned" if is_ban else "unbanned"
                 await update.message.reply_text(f"✅ User {target_id} has been {status}.")
             else:
@@ -271,7 +376,11 @@ async def sudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             try:
                 idx = args.index("-n") if "-n" in args else args.index("--name")
                 grp_name = args[idx + 1]
-                if await add_group(grp_name):
+                if not valid_group_name(grp_name):
+                    await update.message.reply_text(
+                        f"❌ Group names use letters, digits, '_' and '-', up to {MAX_GROUP_NAME_BYTES} bytes."
+                    )
+                elif await add_group(grp_name):
                     await update.message.reply_text(f"✅ Group '{grp_name}' created.")
                 else:
                     await update.message.reply_text(f"⚠️ Group '{grp_name}' already exists.")
@@ -305,67 +414,208 @@ async def sudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         except:
             await update.message.reply_text("⚠️ Usage: /sudo setgrp <chat_id> <group_name>")
 
+    elif command in ["import", "export"]:
+        grp_name = None
+        for flag in ("-n", "--name"):
+            if flag in args and args.index(flag) + 1 < len(args):
+                grp_name = args[args.index(flag) + 1]
+        if not grp_name:
+            await update.message.reply_text(f"⚠️ Usage: /sudo {command} -n <group_name>")
+            return
+        if grp_name not in await get_all_groups():
+            await update.message.reply_text(f"❌ Group '{grp_name}' does not exist.")
+            return
+        if command == "import":
+            await import_group(update, grp_name)
+        else:
+            # Imported on first use to keep it (and csv) off the start-up path
+            import group_io
+            data, count = await group_io.export_members(grp_name)
+            await update.message.reply_document(data, caption=f"📁 {grp_name}: {count} members")
+
     elif command == "send":
-        # Handle /sudo send -g <group> [-m <msg>] OR /sudo send -s
+        # Handle /sudo send -g <group> [-t <time>] [-w <window>] [-m <msg>] OR /sudo send -s
         if "-s" in args or "--stop" in args:
-            await set_setting(f"relay_target_{user_id}", "")
+            await relay.stop_session(user_id)
             await update.message.reply_text("🛑 Relay mode deactivated. Messages will no longer be forwarded.")
             return
 
-        target_grp = None
-        if "-g" in args: target_grp = args[args.index("-g") + 1]
-        elif "--group" in args: target_grp = args[args.index("--group") + 1]
+        # Everything after -m/--message is the message, so the other flags come before it
+        message_at = next((i for i, arg in enumerate(args) if arg in ("-m", "--message")), len(args))
+        message_text = " ".join(args[message_at + 1:]) or None
+        options = args[:message_at]
+
+        flags = ("-g", "--group", "-t", "--at", "-w", "--over")
 
-        message_text = None
-        if "-m" in args:
-            idx = args.index("-m")
-            message_text = " ".join(args[idx + 1:])
-        elif "--message" in args:
-            idx = args.index("--message")
-            message_text = " ".join(args[idx + 1:])
+        def option(*names):
+            # Values may contain spaces (audience expressions): each runs up to the next flag
+            for name in names:
+                if name in options:
+                    start = options.index(name) + 1
+                    end = next((i for i in range(start, len(options)) if options[i] in flags), len(options))
+                    return " ".join(options[start:end]) or None
+            return None
+
+        target_grp = option("-g", "--group")
+        send_at = option("-t", "--at")
+        spread_over = option("-w", "--over")
 
         if not target_grp:
-            await update.message.reply_text("⚠️ Usage: /sudo send -g <group> [-m <message>] (or use -s to stop)")
+            await update.message.reply_text(
+                "⚠️ Usage: /sudo send -g <audience> [-t <time>] [-w <window>] [-m <message>] (or use -s to stop)\n"
+                "Audience example: (vip|beta) & lang:es. Mixing & and | needs parentheses."
+            )
             return
 
-        # Check if group exists (except for 'all')
-        if target_grp != "all":
-            all_grps = await get_all_groups()
-            if target_grp not in all_grps:
-                await update.message.reply_text(f"❌ Group '{target_grp}' does not exist.")
+        scheduled_at, spread = None, 0
+        if send_at or spread_over:
+            if not message_text:
+                await update.message.reply_text("⚠️ -t and -w only apply to one-shot broadcasts (with -m).")
+                return
+            try:
+                scheduled_at, spread = scheduling.parse_schedule(f"{send_at or 'now'} {spread_over or ''}")
+            except scheduling.ScheduleError as e:
+                await update.message.reply_text(f"❌ {e}.")
                 return
 
+        try:
+            recipients = await resolve_audience(target_grp, user_id)
+        except AudienceError as e:
+            await update.message.reply_text(f"❌ {e}.")
+            return
+
         if message_text:
-            # One-shot broadcast
-            users = await get_all_users() if target_grp == "all" else await get_users_in_group(target_grp)
-            success_count = 0
-            for u_id in users:
-                try:
-                    await context.bot.send_message(chat_id=u_id, text=message_text, parse_mode='HTML')
-                    success_count += 1
-                except: continue
-            await update.message.reply_text(f"✅ One-shot message sent to {success_count} users in '{target_grp}'.")
+            # One-shot broadcast, now or at its scheduled time
+            status_msg = await update.message.reply_text(f"📤 Sending to users in '{target_grp}'...")
+            job_id, total = await create_broadcast_job(
+                user_id, target_grp, recipients, text=message_text,
+                status_chat_id=status_msg.chat_id, status_message_id=status_msg.message_id,
+                scheduled_at=scheduled_at, spread=spread
+            )
+            await jobs.launch_job(context.bot, context.job_queue, job_id)
+            when = f", {scheduling.describe(scheduled_at, spread)}" if scheduled_at else ""
+            await status_msg.edit_text(f"📤 Sending to {total} users in '{target_grp}' (job #{job_id}{when})...")
         else:
             # Activate Relay mode
-            await set_setting(f"relay_target_{user_id}", target_grp)
+            await relay.start_session(user_id, target_grp)
             await update.message.reply_text(
                 f"🚀 <b>Live Relay Activated</b>\n\n"
-                f"Target: <code>{target_grp}</code>\n"
+                f"Target: <code>{html.escape(target_grp)}</code>\n"
                 f"Status: Any text or media you send now will be forwarded to this group.\n\n"
                 f"💡 Use <code>/sudo send -s</code> to terminate the session.",
                 parse_mode='HTML'
             )
 
+    elif command == "jobs":
+        actions = {
+            "-p": jobs.pause_job, "--pause": jobs.pause_job,
+            "-c": jobs.cancel_job, "--cancel": jobs.cancel_job,
+        }
+        if len(args) == 1:
+            recent = await get_broadcast_jobs()
+            if not recent:
+                await update.message.reply_text("ℹ️ No broadcast jobs yet.")
+                return
+            text = "🗂 <b>Broadcast Jobs</b>\n\n"
+            for job in recent:
+                text += (
+                    f"• <code>#{job['job_id']}</code> {job['status']} - {html.escape(job['target'])} - "
+                    f"{job['sent']}✅ {job['failed']}❌ / {job['total']}"
+                )
+                if job['status'] == jobs.SCHEDULED or (job['spread'] and job['status'] in ('running', 'paused')):
+                    text += f" - {scheduling.describe(job['scheduled_at'], job['spread'])}"
+                text += "\n"
+            await update.message.reply_text(text, parse_mode='HTML')
+            return
+        try:
+            flag = args[1]
+            job_id = int(args[2])
+        except:
+            await update.message.reply_text("⚠️ Usage: /sudo jobs [-p|-r|-c <job_id>]")
+            return
+        if flag in ("-r", "--resume"):
+            done = await jobs.resume_job(context.bot, job_id)
+        elif flag in actions:
+            done = await actions[flag](job_id)
+        else:
+            await update.message.reply_text("⚠️ Usage: /sudo jobs [-p|-r|-c <job_id>]")
+            return
+        if done:
+            await update.message.reply_text(f"✅ Job #{job_id} updated.")
+        else:
+            await update.message.reply_text(f"❌ Job #{job_id} cannot be changed in its current state.")
+
     else:
         await update.message.reply_text("❓ Unknown sudo command. Type /sudo for help.")
 
+async def import_group(update: Update, grp_name: str) -> None:
+    """Imports the user IDs of the document the /sudo import message replies to."""
+    import group_io
+    reply = update.message.reply_to_message
+    document = reply.document if reply else None
+    if not document:
+        await update.message.reply_text("⚠️ Reply to a CSV/TXT file of user IDs (one per line) with /sudo import -n <group_name>")
+        return
+    if document.file_size and document.file_size > group_io.MAX_IMPORT_SIZE:
+        await update.message.reply_text("❌ File is too large. Bots can only download files up to 20 MB.")
+        return
+
+    status_msg = await update.message.reply_text(f"📥 Downloading {document.file_name or 'file'}...")
+    stream = io.BytesIO()
+    await (await document.get_file()).download_to_memory(stream)
+    stream.seek(0)
+
+    async def on_progress(report):
+        # Progress is cosmetic; a failed edit must not abort the import
+        try:
+            await status_msg.edit_text(report.progress_text(), parse_mode='HTML')
+        except TelegramError:
+            pass
+
+    report = await group_io.import_members(stream, grp_name, on_progress)
+    await status_msg.edit_text(report.summary_text(), parse_mode='HTML')
+
+async def build_users_page(filter_type: str, filter_val: str, page: int):
+    """Builds the text and prev/next buttons for one page of /sudo getusers."""
+    total = await count_users_by_filter(filter_type, filter_val)
+    if not total:
+        return None, None
+    pages = (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    users = await get_users_page(filter_type, filter_val, page * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+
+    text = f"📋 <b>User List ({filter_type})</b>\n\n"
+    for u_id, first_name, username in users:
+        text += f"• <code>{u_id}</code> - {first_name} (@{username or 'N/A'})\n"
+    text += f"\n<i>Page {page + 1}/{pages} • {total} users</i>"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=encode('users', filter_type, filter_val or '', page - 1)))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=encode('users', filter_type, filter_val or '', page + 1)))
+    return text, InlineKeyboardMarkup([nav]) if nav else None
+
+@route('users', args=3, allow=is_admin)
+async def users_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the prev/next buttons of /sudo getusers by editing the list in place."""
+    query = update.callback_query
+    await query.answer()
+
+    filter_type, filter_val, page = context.args
+    text, reply_markup = await build_users_page(filter_type, filter_val or None, int(page))
+    if text is None:
+        await query.edit_message_text("ℹ️ No users found matching criteria.")
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
+
 async def relay_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Relays messages from admins in relay mode to their target group."""
     if not update.message or update.message.text and update.message.text.startswith('/'):
         return
 
     user_id = update.effective_user.id
-    target_grp = await get_setting(f"relay_target_{user_id}")
+    target_grp = relay.get_target(user_id)
     
     if not target_grp:
         return
@@ -374,18 +624,23 @@ async def relay_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not await is_admin(user_id):
         return
 
-    users = await get_all_users() if target_grp == "all" else await get_users_in_group(target_grp)
-    if not users:
+    # Queued on the session's pipeline so the admin can keep sending while it goes out
+    pipeline = relay.get_pipeline(context.bot, user_id)
+    # Checked per message so the session follows bans and membership changes
+    try:
+        recipients = await pipeline.audience(target_grp)
+    except AudienceError as e:
+        await update.message.reply_text(f"❌ Relay target is no longer valid: {e}.")
         return
+    await pipeline.add(update.message, recipients)
 
-    success_count = 0
-    for u_id in users:
-        if u_id == user_id: continue
-        try:
-            # Use copy_message to support all media types
-            await update.message.copy(chat_id=u_id)
-            success_count += 1
-        except: continue
-    
-    # Optional: confirm relay to admin (maybe only for the first few?)
-    # await update.message.reply_text(f"📡 Relayed to {success_count} users.")
+@route('job_report', args=1, allow=is_admin)
+async def send_failure_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the per-reason failure report of a broadcast job as a CSV file."""
+    query = update.callback_query
+    await query.answer()
+    job_id = int(context.args[0])
+    data, reasons = await progress.failure_report(job_id)
+    summary = "\n".join(f"{count} × {reason}" for reason, count in reasons.most_common(progress.TOP_REASONS))
+    # Captions are limited to 1024 characters
+    await query.message.reply_document(data, caption=f"📄 Failures of job #{job_id}\n\n{summary}"[:1024])
@@ -0,0 +1,215 @@
+"""
+Broadcast audiences as set expressions over in-memory membership sets, e.g.
+
+    (vip|beta) & lang:es & !premium
+
+Terms: `all`, `premium`, `lang:<code>`, `group:<name>` or a bare group name.
+Banned and unreachable users never receive broadcasts, so they are not terms;
+every result leaves them out. Operators: `!` (not), `&` (and), `|` (or), with parentheses. Mixing `&`
+and `|` needs parentheses, so `vip|beta & lang:es` is rejected; write
+`(vip|beta) & lang:es` or `vip | (beta & lang:es)`.
+
+The sets are loaded from the database once and then kept current by the
+write functions in database.py, so resolving an audience never scans users.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+_TOKEN = re.compile(r'\s*(?:([()&|!])|([^\s()&|!]+))')
+# Always subtracted by evaluate(), so naming them could only ever select nobody
+_EXCLUDED_TERMS = {'banned': '/sudo getusers -b', 'unreachable': '/sudo getusers -u'}
+
+# Group names are single terms, short enough to fit in a button's callback_data
+MAX_GROUP_NAME_BYTES = 32
+
+def valid_group_name(name: str) -> bool:
+    """Letters (with their combining marks), digits, '_' and '-', at most MAX_GROUP_NAME_BYTES bytes of UTF-8."""
+    return 0 < len(name.encode()) <= MAX_GROUP_NAME_BYTES and all(
+        char.isalnum() or char in '_-' or unicodedata.category(char).startswith('M') for char in name
+    )
+
+class AudienceError(ValueError):
+    """Raised for an expression that cannot be parsed or names an unknown group."""
+
+class AudienceIndex:
+    """Membership sets for every user attribute an audience can be built from."""
+
+    def __init__(self):
+        self.loaded = False
+        # True while the sets are read; writes meanwhile are queued and replayed
+        self.loading = False
+        # Bumped on every change, so callers can reuse what they resolved from an unchanged index
+        self.version = 0
+        self.users = set()
+        self.banned = set()
+        self.premium = set()
+        self.unreachable = set()
+        self.languages = defaultdict(set)
+        self.groups = {}
+        self._backlog = []
+
+    def begin_load(self):
+        self.loading = True
+        self._backlog = []
+
+    def abort_load(self):
+        self.loading = False
+        self._backlog = []
+
+    def finish_load(self, users, banned, premium, unreachable, languages, groups):
+        """Installs freshly loaded sets, then replays writes made while they were read."""
+        self.users, self.banned, self.premium, self.unreachable = users, banned, premium, unreachable
+        self.languages = defaultdict(set, languages)
+        self.groups = groups
+        self.loading = False
+        self.loaded = True
+        self.version += 1
+        backlog, self._backlog = self._backlog, []
+        for op, args in backlog:
+            self.apply(op, *args)
+
+    def apply(self, op: str, *args):
+        """Applies one write; ignored until loaded (the load will read it from the database)."""
+        if self.loading:
+            self._backlog.append((op, args))
+        elif self.loaded:
+            getattr(self, op)(*args)
+            self.version += 1
+
+    # Write operations, named after the `op` passed to apply()
+
+    def add_user(self, user_id: int, language: str, premium: bool):
+        self.users.add(user_id)
+        self.set_language(user_id, language)
+        self.set_premium(user_id, premium)
+
+    def set_language(self, user_id: int, language: str):
+        for members in self.languages.values():
+            members.discard(user_id)
+        self.languages[language].add(user_id)
+
+    def set_premium(self, user_id: int, premium: bool):
+        (self.premium.add if premium else self.premium.discard)(user_id)
+
+    def set_banned(self, user_id: int, banned: bool):
+        (self.banned.add if banned else self.banned.discard)(user_id)
+
+    def set_unreachable(self, user_ids):
+        self.unreachable.update(user_ids)
+
+    def set_reachable(self, user_ids):
+        self.unreachable.difference_update(user_ids)
+
+    def add_group(self, name: str):
+        self.groups.setdefault(name, set())
+
+    def remove_group(self, name: str):
+        self.groups.pop(name, None)
+
+    def add_to_group(self, user_id: int, name: str):
+        self.groups.setdefault(name, set()).add(user_id)
+
+    def add_members(self, name: str, user_ids):
+        self.groups.setdefault(name, set()).update(user_ids)
+
+    def term(self, word: str) -> set:
+        if word == 'all':
+            return self.users
+        if word == 'premium':
+            return self.premium
+        if word in _EXCLUDED_TERMS:
+            raise AudienceError(f"'{word}' users never receive broadcasts; list them with {_EXCLUDED_TERMS[word]}")
+        kind, sep, value = word.partition(':')
+        if not sep:
+            kind, value = 'group', word
+        if kind == 'lang':
+            return self.languages.get(value, set())
+        if kind == 'group':
+            if value not in self.groups:
+                raise AudienceError(f"Group '{value}' does not exist")
+            return self.groups[value]
+        raise AudienceError(f"Unknown term '{word}'")
+
+def _tokenize(expression: str):
+    tokens, pos = [], 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match:
+            raise AudienceError(f"Unexpected input at position {pos}")
+        tokens.append(match.group(1) or match.group(2))
+        pos = match.end()
+    return tokens
+
+class _Parser:
+    """
+    Recursive descent: expr := term ('|' term)*, term := factor ('&' factor)*,
+    except that a term with '&' cannot be combined with '|' outside parentheses.
+    """
+
+    def __init__(self, tokens, index: AudienceIndex):
+        self.tokens = tokens
+        self.pos = 0
+        self.index = index
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise AudienceError("Expression ends too early")
+        self.pos += 1
+        return token
+
+    def expr(self) -> set:
+        result, mixed = self.conjunction()
+        while self.peek() == '|':
+            self.take()
+            term, has_and = self.conjunction()
+            mixed = mixed or has_and
+            if mixed:
+                raise AudienceError("Use parentheses when mixing & and |, e.g. (vip|beta) & lang:es")
+            result = result | term
+        return result
+
+    def conjunction(self) -> tuple:
+        """(members, whether '&' was used)."""
+        result = self.factor()
+        has_and = False
+        while self.peek() == '&':
+            self.take()
+            has_and = True
+            result = result & self.factor()
+        return result, has_and
+
+    def factor(self) -> set:
+        token = self.take()
+        if token == '!':
+            return self.index.users - self.factor()
+        if token == '(':
+            result = self.expr()
+            if self.take() != ')':
+                raise AudienceError("Missing ')'")
+            return result
+        if token in (')', '&', '|'):
+            raise AudienceError(f"Unexpected '{token}'")
+        return self.index.term(token)
+
+def evaluate(expression: str, index: AudienceIndex, exclude=()) -> set:
+    """
+    Resolves an expression to user IDs. Banned and unreachable users and
+    `exclude` (e.g. the sending admin) are always left out.
+    """
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise AudienceError("Empty audience")
+    parser = _Parser(tokens, index)
+    result = parser.expr()
+    if parser.peek() is not None:
+        raise AudienceError(f"Unexpected '{parser.peek()}'")
+    return result - index.banned - index.unreachable - set(exclude)
+
+# Kept current by database.py
+index = AudienceIndex()
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+from database import mark_unreachable
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second in bulk and about one message
+# per second to the same chat. Both can be tuned from the environment.
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+PER_CHAT_RATE = float(os.getenv('BROADCAST_PER_CHAT_RATE', '1'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+# Unreachable recipients are written in batches of this size
+UNREACHABLE_BATCH = int(os.getenv('BROADCAST_UNREACHABLE_BATCH', '200'))
+
+# BadRequest descriptions that mean the chat is gone for good
+_GONE_CHAT = ('chat not found', 'user is deactivated', 'peer_id_invalid')
+
+def is_unreachable(error: Exception) -> bool:
+    """True for errors meaning the user blocked the bot or no longer exists."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in _GONE_CHAT)
+
+def _seconds(value) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version."""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+class TokenBucket:
+    """An asyncio token bucket. `pause` blocks every caller, e.g. after a flood wait."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class ChatThrottle:
+    """Spaces out consecutive sends to the same chat."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_slot = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        # Forget chats whose slot has passed so the table stays small.
+        if len(self._next_slot) > 10000:
+            self._next_slot = {c: t for c, t in self._next_slot.items() if t > now}
+
+# Shared by every send path, since Telegram's limits apply to the bot as a whole.
+global_bucket = TokenBucket(BROADCAST_RATE)
+chat_throttle = ChatThrottle(PER_CHAT_RATE)
+
+@dataclass
+class BroadcastResult:
+    sent: int = 0
+    failed: int = 0
+    unreachable: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Achieved messages per second."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+async def deliver(send, chat_id: int):
+    """
+    Sends one message through the shared rate limits.
+    Waits out RetryAfter without spending a retry and retries transient network
+    errors with backoff. Any other error is raised to the caller.
+    """
+    attempt = 0
+    while True:
+        await chat_throttle.wait(chat_id)
+        await global_bucket.acquire()
+        try:
+            return await send(chat_id)
+        except RetryAfter as e:
+            delay = _seconds(e.retry_after)
+            logger.warning(f"Flood limit hit, backing off for {delay}s")
+            global_bucket.pause(delay)
+        except BadRequest:
+            # A subclass of NetworkError, but retrying cannot fix the request
+            raise
+        except NetworkError as e:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            logger.warning(f"Network error sending to {chat_id} (attempt {attempt}): {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+async def _acquire_unless_stopped(bucket: TokenBucket, stop: asyncio.Event) -> bool:
+    """Waits for a token, or until `stop` is set. Returns True if a token was taken and not stopped."""
+    if stop is None:
+        await bucket.acquire()
+        return True
+    acquire = asyncio.create_task(bucket.acquire())
+    stopped = asyncio.create_task(stop.wait())
+    done, pending = await asyncio.wait((acquire, stopped), return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    return acquire in done and not stop.is_set()
+
+async def broadcast(send, recipients, concurrency: int = BROADCAST_CONCURRENCY, on_result=None,
+                    rate: float = None, stop: asyncio.Event = None) -> BroadcastResult:
+    """
+    Calls `send(chat_id)` for every recipient with bounded concurrency.
+    `recipients` may be a regular or an async iterable; it is consumed lazily.
+    `send` must return an awaitable that performs a single Bot API call.
+    `on_result(chat_id, error)` is called after each recipient, with error None on success.
+    `rate` additionally paces this broadcast to that many messages per second.
+    Once `stop` is set, queued recipients are skipped without a result, even mid-wait for the pace.
+    Recipients that blocked the bot or no longer exist are marked unreachable.
+    """
+    result = BroadcastResult()
+    pace = TokenBucket(rate, capacity=1) if rate else None
+    unreachable = []
+
+    async def record_unreachable():
+        batch = unreachable[:]
+        unreachable.clear()
+        try:
+            await mark_unreachable(batch)
+        except Exception as e:
+            logger.error(f"Failed to mark {len(batch)} users unreachable: {e}")
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    started = time.monotonic()
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            error = None
+            if stop is not None and stop.is_set():
+                continue
+            if pace and not await _acquire_unless_stopped(pace, stop):
+                continue
+            try:
+                await deliver(send, chat_id)
+                result.sent += 1
+                metrics.broadcast_messages.inc('sent')
+                metrics.delivery_rate.mark()
+            except Exception as e:
+                result.failed += 1
+                error = e
+                if is_unreachable(e):
+                    result.unreachable += 1
+                    metrics.broadcast_messages.inc('unreachable')
+                    unreachable.append(chat_id)
+                    if len(unreachable) >= UNREACHABLE_BATCH:
+                        await record_unreachable()
+                else:
+                    logger.error(f"Failed to send to {chat_id}: {e}")
+                    metrics.broadcast_messages.inc('failed')
+            if on_result:
+                on_result(chat_id, error)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        if hasattr(recipients, '__aiter__'):
+            async for chat_id in recipients:
+                await queue.put(chat_id)
+        else:
+            for chat_id in recipients:
+                await queue.put(chat_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        if unreachable:
+            await record_unreachable()
+
+    result.elapsed = time.monotonic() - started
+    metrics.broadcast_rate.set(result.rate)
+    logger.info(f"Broadcast finished: {result.sent} sent, {result.failed} failed "
+                f"({result.unreachable} unreachable), {result.rate:.1f} msg/s")
+    return result
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class TTLCache:
+    """A bounded LRU cache whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation so a read that raced a write can't
+        # put the stale value back (see `set`).
+        self.generation = 0
+
+    def get(self, key, default=MISSING):
+        """Returns the cached value, or `default` (MISSING) when absent or expired."""
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, generation: int = None):
+        """Stores a value. Pass the `generation` read before the lookup to drop stale results."""
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        self.generation += 1
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
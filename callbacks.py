@@ -0,0 +1,126 @@
+"""
+Routing for inline button taps. Every button's callback_data is built by
+encode() as
+
+    <tag><version>|<action>|<arg>|...
+
+where the tag is a truncated HMAC of the rest, keyed with the bot token.
+Arguments may hold any text: '|' and '%' in them are escaped as %7C and %25.
+dispatch() checks the tag and version, then finds the handler with a
+single dict lookup, so forged data and buttons left over from older
+releases are rejected before any handler or database query runs. Handlers
+register with @route and read their arguments from context.args.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import time
+from collections import namedtuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump when the meaning of an action's arguments changes; older buttons then read as expired
+CALLBACK_VERSION = '1'
+# Telegram's limit for callback_data
+MAX_CALLBACK_DATA = 64
+
+_SEP = '|'
+_TAG_LEN = 6
+
+Route = namedtuple('Route', 'callback args allow conversation')
+_routes = {}
+_key = None
+
+def route(action: str, args: int = 0, allow=None, conversation: str = None):
+    """
+    Registers a handler for an action. `allow(user_id)` is awaited before the
+    handler runs; `conversation` marks actions that only make sense inside that
+    ConversationHandler state, so taps on them afterwards are expired.
+    """
+    def register(callback):
+        if action in _routes or _SEP in action:
+            raise ValueError(f"Invalid or duplicate callback action '{action}'")
+        _routes[action] = Route(callback, args, allow, conversation)
+        return callback
+    return register
+
+def _tag(payload: str) -> str:
+    global _key
+    if _key is None:
+        _key = hashlib.sha256(f"callback:{os.getenv('TELEGRAM_BOT_TOKEN', '')}".encode()).digest()
+    digest = hmac.new(_key, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest)[:_TAG_LEN].decode()
+
+def _escape(arg) -> str:
+    return str(arg).replace('%', '%25').replace(_SEP, '%7C')
+
+def _unescape(arg: str) -> str:
+    # Every '%' in escaped text starts '%25' or '%7C', so the order of these cannot mix them up
+    return arg.replace('%7C', _SEP).replace('%25', '%')
+
+def encode(action: str, *args) -> str:
+    """
+    callback_data for a button that runs `action` with `args`. Raises
+    ValueError if the result is over Telegram's MAX_CALLBACK_DATA bytes.
+    """
+    payload = _SEP.join((CALLBACK_VERSION, action) + tuple(_escape(arg) for arg in args))
+    data = _tag(payload) + payload
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data for '{action}' is longer than {MAX_CALLBACK_DATA} bytes")
+    return data
+
+def _split(data) -> list:
+    # [version, action, *args], or an empty list for anything not built by encode()
+    if not isinstance(data, str) or len(data) < _TAG_LEN + 2:
+        return []
+    return data[_TAG_LEN:].split(_SEP)
+
+def pattern(*actions):
+    """CallbackQueryHandler pattern matching the given actions, for ConversationHandler states."""
+    actions = frozenset(actions)
+    return lambda data: len(parts := _split(data)) > 1 and parts[1] in actions
+
+def _reject(reason: str, data):
+    metrics.callbacks_rejected.inc(reason)
+    logger.debug(f"Rejected callback ({reason}): {data!r}")
+
+async def _dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE, in_conversation: bool):
+    query = update.callback_query
+    parts = _split(query.data)
+    if not parts or not hmac.compare_digest(query.data[:_TAG_LEN], _tag(query.data[_TAG_LEN:])):
+        # Old-style data from before this router is as expired as a forged tag
+        _reject('forged' if len(parts) > 1 and parts[0] == CALLBACK_VERSION else 'stale', query.data)
+        await query.answer("⌛ This button has expired.")
+        return None
+    action = parts[1] if len(parts) > 1 else None
+    target = _routes.get(action) if parts[0] == CALLBACK_VERSION else None
+    if target is None or len(parts) - 2 != target.args or (target.conversation and not in_conversation):
+        _reject('stale', query.data)
+        await query.answer("⌛ This button has expired.")
+        return None
+    if target.allow and not await target.allow(query.from_user.id):
+        _reject('denied', query.data)
+        await query.answer("⛔ Access denied.", show_alert=True)
+        return None
+
+    context.args = [_unescape(arg) for arg in parts[2:]]
+    started = time.perf_counter()
+    try:
+        return await target.callback(update, context)
+    finally:
+        metrics.callback_latency.observe(time.perf_counter() - started, action)
+
+async def dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """The one top-level CallbackQueryHandler callback."""
+    await _dispatch(update, context, in_conversation=False)
+
+async def dispatch_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Callback for CallbackQueryHandlers inside ConversationHandler states; returns the next state."""
+    return await _dispatch(update, context, in_conversation=True)
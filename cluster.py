@@ -0,0 +1,367 @@
+"""
+Multi-process deployment. A supervisor fetches updates (polling or webhook),
+routes each one to a worker process by hashing its user/chat id, restarts
+workers that die and rolls through all of them on SIGHUP. Workers are regular
+bot processes fed over local HTTP; they share the SQLite file (WAL) and tell
+each other about cache invalidations and job control through the supervisor.
+
+    python main.py --mode cluster --workers 4
+"""
+import asyncio
+import hmac
+import inspect
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+from collections import defaultdict
+
+import httpx
+from telegram import Update
+
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 2)))
+# How the supervisor receives updates: 'polling' or 'webhook' (uses the WEBHOOK_* settings)
+CLUSTER_FRONT = os.getenv('CLUSTER_FRONT', 'polling')
+# The supervisor's control endpoint listens here; worker i on CLUSTER_BASE_PORT + 1 + i
+CLUSTER_HOST = '127.0.0.1'
+CLUSTER_BASE_PORT = int(os.getenv('CLUSTER_BASE_PORT', '8200'))
+# Updates buffered per worker, e.g. while it restarts
+CLUSTER_QUEUE_SIZE = int(os.getenv('CLUSTER_QUEUE_SIZE', '10000'))
+WORKER_START_TIMEOUT = float(os.getenv('CLUSTER_WORKER_START_TIMEOUT', '60'))
+POLL_TIMEOUT = 30
+
+# Set by the supervisor in each worker's environment
+WORKER_ID = int(os.getenv('CLUSTER_WORKER_ID', '-1'))
+WORKER_COUNT = int(os.getenv('CLUSTER_WORKER_COUNT', '0'))
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+
+UPDATE_PATH = '/update'
+EVENTS_PATH = '/events'
+HEALTH_PATH = '/health'
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+def is_worker() -> bool:
+    return WORKER_COUNT > 0
+
+def owns(key: int) -> bool:
+    """True if this process is responsible for `key` (always, outside cluster mode)."""
+    return not is_worker() or key % WORKER_COUNT == WORKER_ID
+
+def routing_key(update: dict):
+    """User id (or chat id) of a raw update; mirrors update_processor.ordering_key."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return None
+
+# --- Events between workers ---
+
+_subscribers = defaultdict(list)
+_client = None
+_pending = set()
+
+def subscribe(kind: str, handler):
+    """Registers `handler(application, **payload)` for events published by other workers."""
+    _subscribers[kind].append(handler)
+
+def publish(kind: str, **payload):
+    """Sends an event to every other worker. Does nothing outside cluster mode."""
+    if not is_worker():
+        return
+    task = asyncio.create_task(_post_event(kind, payload))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+def _http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=10, headers={SECRET_HEADER: CLUSTER_SECRET})
+    return _client
+
+async def _post_event(kind: str, payload: dict):
+    try:
+        await _http_client().post(f"http://{CLUSTER_HOST}:{CLUSTER_BASE_PORT}{EVENTS_PATH}",
+                                  json={'kind': kind, 'payload': payload, 'origin': WORKER_ID})
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to publish {kind} event: {e}")
+
+def _authorized(request: httpserver.Request, secret: str = None) -> bool:
+    secret = CLUSTER_SECRET if secret is None else secret
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), secret.encode())
+
+async def _dispatch_event(application, event: dict):
+    for handler in _subscribers.get(event['kind'], []):
+        try:
+            result = handler(application, **event['payload'])
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.exception(f"Error handling {event['kind']} event: {e}")
+
+# --- Worker ---
+
+def run_worker(application):
+    """Blocking entry point of a worker: serves updates and events from the supervisor."""
+    import webhook
+
+    updates = webhook.make_handler(application, UPDATE_PATH, CLUSTER_SECRET)
+
+    async def handle(request: httpserver.Request) -> httpserver.Response:
+        if request.path == HEALTH_PATH:
+            return httpserver.Response(200, 'OK')
+        if request.path == EVENTS_PATH:
+            if not _authorized(request):
+                return httpserver.Response(403, 'Forbidden')
+            await _dispatch_event(application, request.json())
+            return httpserver.Response(200, 'OK')
+        return await updates(request)
+
+    async def serve():
+        try:
+            await webhook.serve(application, CLUSTER_HOST, CLUSTER_BASE_PORT + 1 + WORKER_ID, handler=handle,
+                                url='', tls=False)
+        finally:
+            if _pending:
+                await asyncio.gather(*_pending, return_exceptions=True)
+            if _client:
+                await _client.aclose()
+
+    asyncio.run(serve())
+
+# --- Supervisor ---
+
+class Worker:
+    """One worker process and the ordered queue of updates routed to it."""
+
+    def __init__(self, index: int, count: int, secret: str):
+        self.index = index
+        self.count = count
+        self.secret = secret
+        self.port = CLUSTER_BASE_PORT + 1 + index
+        self.url = f"http://{CLUSTER_HOST}:{self.port}"
+        self.queue = asyncio.Queue(maxsize=CLUSTER_QUEUE_SIZE)
+        self.ready = asyncio.Event()
+        self.process = None
+        self.restarting = False
+
+    def _env(self) -> dict:
+        env = dict(os.environ, CLUSTER_WORKER_ID=str(self.index), CLUSTER_WORKER_COUNT=str(self.count),
+                   CLUSTER_SECRET=self.secret, CLUSTER_BASE_PORT=str(CLUSTER_BASE_PORT))
+        metrics_port = int(os.getenv('METRICS_PORT', '9090'))
+        env['METRICS_PORT'] = str(metrics_port + 1 + self.index if metrics_port else 0)
+        return env
+
+    async def start(self, client: httpx.AsyncClient):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, MAIN_SCRIPT, '--mode', 'worker', env=self._env(),
+            # Own session: Ctrl+C reaches only the supervisor, which stops workers in order
+            start_new_session=True)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WORKER_START_TIMEOUT
+        while loop.time() < deadline and self.process.returncode is None:
+            try:
+                if (await client.get(self.url + HEALTH_PATH)).status_code == 200:
+                    self.ready.set()
+                    logger.info(f"Worker {self.index} ready (pid {self.process.pid})")
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"Worker {self.index} did not start")
+
+    async def stop(self):
+        """SIGTERM lets the worker finish the updates it already accepted."""
+        self.ready.clear()
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+    async def sender(self, client: httpx.AsyncClient):
+        """Forwards queued updates one at a time, so each user's updates keep their order."""
+        while True:
+            body = await self.queue.get()
+            while True:
+                await self.ready.wait()
+                try:
+                    response = await client.post(self.url + UPDATE_PATH, content=body,
+                                                 headers={'content-type': 'application/json'})
+                    if response.status_code == 200:
+                        break
+                    if response.status_code == 400:
+                        logger.warning(f"Worker {self.index} rejected an update")
+                        break
+                except httpx.HTTPError as e:
+                    logger.warning(f"Worker {self.index} unreachable: {e}")
+                await asyncio.sleep(0.5)
+            self.queue.task_done()
+
+class Supervisor:
+    def __init__(self, count: int = CLUSTER_WORKERS, front: str = CLUSTER_FRONT):
+        self.secret = CLUSTER_SECRET or secrets.token_urlsafe(32)
+        self.front = front
+        self.workers = [Worker(i, count, self.secret) for i in range(count)]
+        self.stopping = asyncio.Event()
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(10, read=POLL_TIMEOUT + 10),
+                                        headers={SECRET_HEADER: self.secret})
+        self._next = 0
+        self._rolling = asyncio.Lock()
+
+    async def route(self, body: bytes, update: dict):
+        key = routing_key(update)
+        if key is None:
+            # Nothing to keep in order; spread evenly
+            key, self._next = self._next, self._next + 1
+        await self.workers[key % len(self.workers)].queue.put(body)
+
+    async def handle_control(self, request: httpserver.Request) -> httpserver.Response:
+        if request.path != EVENTS_PATH or request.method != 'POST':
+            return httpserver.Response(404, 'Not Found')
+        if not _authorized(request, self.secret):
+            return httpserver.Response(403, 'Forbidden')
+        event = request.json()
+        others = [w for w in self.workers if w.index != event.get('origin') and w.ready.is_set()]
+        await asyncio.gather(*(self._forward_event(w, request.body) for w in others))
+        return httpserver.Response(200, 'OK')
+
+    async def _forward_event(self, worker: Worker, body: bytes):
+        try:
+            await self.client.post(worker.url + EVENTS_PATH, content=body,
+                                   headers={'content-type': 'application/json'})
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to forward event to worker {worker.index}: {e}")
+
+    async def watch(self, worker: Worker):
+        """Restarts a worker that exits on its own."""
+        while not self.stopping.is_set():
+            await worker.process.wait()
+            if self.stopping.is_set() or worker.restarting:
+                await asyncio.sleep(0.5)
+                continue
+            logger.error(f"Worker {worker.index} exited with {worker.process.returncode}; restarting")
+            worker.ready.clear()
+            await asyncio.sleep(1)
+            try:
+                await worker.start(self.client)
+            except RuntimeError as e:
+                logger.error(str(e))
+
+    async def rolling_restart(self):
+        """Restarts workers one by one; each one's updates wait in its queue meanwhile."""
+        async with self._rolling:
+            for worker in self.workers:
+                logger.info(f"Restarting worker {worker.index}")
+                worker.restarting = True
+                try:
+                    await worker.stop()
+                    await worker.start(self.client)
+                finally:
+                    worker.restarting = False
+            logger.info("Rolling restart complete")
+
+    async def poll(self, base_url: str):
+        offset = None
+        await self.client.post(f"{base_url}/deleteWebhook")
+        while not self.stopping.is_set():
+            params = {'timeout': POLL_TIMEOUT, 'allowed_updates': json.dumps(Update.ALL_TYPES)}
+            if offset is not None:
+                params['offset'] = offset
+            try:
+                response = await self.client.post(f"{base_url}/getUpdates", data=params)
+                updates = response.json().get('result') or []
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.route(json.dumps(update).encode(), update)
+                offset = update['update_id'] + 1
+
+    def webhook_handler(self):
+        import webhook
+
+        async def handle(request: httpserver.Request) -> httpserver.Response:
+            if request.path != webhook.WEBHOOK_PATH:
+                return httpserver.Response(404, 'Not Found')
+            if request.method != 'POST':
+                return httpserver.Response(405, 'Method Not Allowed')
+            if webhook.WEBHOOK_SECRET and not _authorized(request, webhook.WEBHOOK_SECRET):
+                return httpserver.Response(403, 'Forbidden')
+            try:
+                update = request.json()
+            except ValueError:
+                return httpserver.Response(400, 'Bad Request')
+            await self.route(request.body, update)
+            return httpserver.Response(200, 'OK')
+        return handle
+
+    async def run(self, token: str, api_url: str = None):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.rolling_restart()))
+
+        control = await httpserver.serve(self.handle_control, CLUSTER_HOST, CLUSTER_BASE_PORT)
+        await asyncio.gather(*(w.start(self.client) for w in self.workers))
+        tasks = [asyncio.create_task(w.sender(self.client)) for w in self.workers]
+        tasks += [asyncio.create_task(self.watch(w)) for w in self.workers]
+
+        base_url = f"{api_url or 'https://api.telegram.org/bot'}{token}"
+        front = poller = None
+        if self.front == 'webhook':
+            front = await self._start_webhook_front(base_url)
+        else:
+            poller = asyncio.create_task(self.poll(base_url))
+        logger.info(f"Cluster running: {len(self.workers)} workers, {self.front} front")
+
+        await self.stopping.wait()
+        logger.info("Stopping cluster...")
+        if front:
+            front.close()
+            await front.wait_closed()
+        if poller:
+            poller.cancel()
+        # Hand every accepted update to its worker before stopping the workers
+        try:
+            await asyncio.wait_for(asyncio.gather(*(w.queue.join() for w in self.workers)), 30)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up waiting for queued updates")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*(w.stop() for w in self.workers))
+        control.close()
+        await control.wait_closed()
+        await self.client.aclose()
+
+    async def _start_webhook_front(self, base_url: str):
+        import webhook
+
+        if webhook.WEBHOOK_URL:
+            data = {'url': webhook.WEBHOOK_URL, 'allowed_updates': json.dumps(Update.ALL_TYPES)}
+            if webhook.WEBHOOK_SECRET:
+                data['secret_token'] = webhook.WEBHOOK_SECRET
+            files = {'certificate': open(webhook.WEBHOOK_CERT, 'rb')} if webhook.WEBHOOK_CERT else None
+            try:
+                await self.client.post(f"{base_url}/setWebhook", data=data, files=files)
+            finally:
+                if files:
+                    files['certificate'].close()
+        return await httpserver.serve(self.webhook_handler(), webhook.WEBHOOK_LISTEN, webhook.WEBHOOK_PORT,
+                                      webhook._ssl_context())
+
+def run_supervisor(token: str, api_url: str = None, workers: int = CLUSTER_WORKERS):
+    """Blocking entry point of the supervisor."""
+    asyncio.run(Supervisor(workers).run(token, api_url))
@@ -1,13 +1,13 @@
-import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import get_user_language, check_and_register_user, update_user_language, get_setting, is_admin_in_db, is_user_banned
+from database import (
+    get_user_language, check_and_register_user, update_user_language, get_setting, is_admin_in_db, is_user_banned,
+    reactivate_user
+)
+from i18n import catalog
+from callbacks import encode, route
 import os
 
-# Load messages from JSON file
-with open('messages.json', 'r', encoding='utf-8') as f:
-    messages = json.load(f)
-
 # For security, you should add ADMIN_ID to your .env file
 ADMIN_ID = os.getenv('ADMIN_ID')
 if ADMIN_ID:
@@ -33,9 +33,25 @@ async def is_bot_disabled(user_id):
         return not await is_admin(user_id)
     return False
 
+async def track_reachability(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Registered in an early handler group: any message or button tap proves a
+    user who had blocked the bot (or looked deleted) is reachable again.
+    """
+    if isinstance(update, Update) and update.effective_user:
+        await reactivate_user(update.effective_user.id)
+
 def get_message(lang_code: str, key: str, default: str = "Message not found.") -> str:
-    """Safely retrieves a message from the loaded JSON data, with fallbacks."""
-    return messages.get(lang_code, {}).get(key) or messages.get('en', {}).get(key, default)
+    """Safely retrieves a message template from the catalog, with fallbacks."""
+    return catalog.get(lang_code, key, default)
+
+def language_buttons(action: str = 'setlang', per_row: int = 3):
+    """Builds keyboard rows with one button per language in messages.json."""
+    buttons = [
+        InlineKeyboardButton(catalog.language_name(code), callback_data=encode(action, code))
+        for code in catalog.languages
+    ]
+    return [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /start command."""
@@ -51,8 +67,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg_key = 'welcome_new' if is_new else 'welcome_back'
     lang = await get_user_language(user.id)
     
-    raw_text = get_message(lang, msg_key)
-    formatted_text = raw_text.format(name=user.full_name)
+    formatted_text = catalog.render(lang, msg_key, name=user.full_name)
     await update.message.reply_html(text=formatted_text)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -65,7 +80,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     lang = await get_user_language(user.id)
-    text = get_message(lang, 'help')
+    text = catalog.render(lang, 'help')
     await update.message.reply_html(text=text)
 
 async def show_languages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -78,29 +93,23 @@ async def show_languages(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     lang = await get_user_language(user.id)
-    text = get_message(lang, 'language_select')
+    text = catalog.render(lang, 'language_select')
     
-    keyboard = [
-        [
-            InlineKeyboardButton("English", callback_data="en"), 
-            InlineKeyboardButton("Spanish", callback_data="es"),
-            InlineKeyboardButton("Tamil", callback_data="ta")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = InlineKeyboardMarkup(language_buttons())
     await update.message.reply_html(text, reply_markup=reply_markup)
 
+@route('setlang', args=1)
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Updates the user's language choice from a callback query."""
     query = update.callback_query
     await query.answer()
     
-    new_lang = query.data
+    new_lang = context.args[0]
     user_id = query.from_user.id
     
     await update_user_language(user_id, new_lang)
     
-    text = get_message(new_lang, 'language_changed').format(language=new_lang.upper())
+    text = catalog.render(new_lang, 'language_changed', language=new_lang.upper())
     await query.edit_message_text(text=text, parse_mode='HTML')
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -113,5 +122,5 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     lang = await get_user_language(user.id)
-    text = get_message(lang, 'unknown_command')
+    text = catalog.render(lang, 'unknown_command')
     await update.message.reply_html(text)
@@ -1,84 +1,376 @@
+import asyncio
+import logging
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache, MISSING
+import cluster
+import audience
+import metrics
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = 'users.db'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+# Rows fetched per page by the iter_* recipient generators
+RECIPIENT_CHUNK_SIZE = int(os.getenv('RECIPIENT_CHUNK_SIZE', '1000'))
+
+# Per-user banned/admin/language state and global settings read on every update.
+# Keys are ('lang' | 'banned' | 'admin', user_id) and ('setting', key); every write
+# function below invalidates the keys it touches.
+state_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '50000')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '300'))
+)
+
+def _invalidate(*keys):
+    """Drops keys from this process's cache and, in cluster mode, from every other worker's."""
+    state_cache.invalidate(*keys)
+    cluster.publish('invalidate', keys=keys)
+
+def _on_invalidate(application, keys):
+    # Keys arrive as JSON lists
+    state_cache.invalidate(*(tuple(key) for key in keys))
+
+cluster.subscribe('invalidate', _on_invalidate)
+
+def _index(op: str, *args):
+    """Applies a write to the audience sets here and, in cluster mode, on every other worker."""
+    audience.index.apply(op, *args)
+    cluster.publish('audience', op=op, args=args)
+
+def _on_audience(application, op, args):
+    audience.index.apply(op, *args)
+
+cluster.subscribe('audience', _on_audience)
+
+# Applied to every pooled connection. WAL lets readers run alongside the single
+# writer; NORMAL sync is durable across application crashes in WAL mode.
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+)
+
+class ConnectionPool:
+    """
+    A fixed set of long-lived SQLite connections driven by a dedicated executor.
+    Every executor thread owns exactly one connection, so queries never run on
+    the event loop and never pay for a connect/teardown.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='sqlite')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, fn):
+        conn = self._connection()
+        # Commits on success and rolls back on error, like the old per-call connections.
+        with conn:
+            return fn(conn)
+
+    async def run(self, fn):
+        """Runs fn(conn) on a pooled connection and returns its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn)
+
+    def close(self):
+        """Waits for pending queries and closes every pooled connection."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+_pool = None
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+    return _pool
+
+def close_db():
+    """Closes the connection pool. Safe to call when it was never opened."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+async def _run(fn):
+    # Queries are nested functions, so the outer function names the metric
+    started = time.perf_counter()
+    try:
+        return await get_pool().run(fn)
+    finally:
+        metrics.db_latency.observe(time.perf_counter() - started, fn.__qualname__.split('.')[0])
+
+def _migration_1(cursor):
+    """Baseline schema. Also upgrades databases created before migrations were tracked."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            language_code TEXT DEFAULT 'en',
+            is_premium INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Migration to add missing columns
+    cursor.execute("PRAGMA table_info(users)")
+    existing_columns = [info[1] for info in cursor.fetchall()]
+
+    new_columns = {
+        'username': 'TEXT',
+        'first_name': 'TEXT',
+        'last_name': 'TEXT',
+        'language_code': "TEXT DEFAULT 'en'",
+        'is_premium': 'INTEGER DEFAULT 0',
+        'is_banned': 'INTEGER DEFAULT 0'
+    }
+
+    for column_name, column_type in new_columns.items():
+        if column_name not in existing_columns:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN {column_name} {column_type}")
+
+    # Create admins table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            admin_id INTEGER PRIMARY KEY
+        )
+    ''')
+
+    # Create settings table for global bot settings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # Create groups table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            name TEXT PRIMARY KEY
+        )
+    ''')
+
+    # Create user_groups mapping table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            user_id INTEGER,
+            group_name TEXT,
+            PRIMARY KEY (user_id, group_name),
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (group_name) REFERENCES groups (name)
+        )
+    ''')
+
+    # Create broadcast job tables. Recipients are a snapshot keyed by user_id so
+    # a job's cursor can be the highest user_id whose delivery is settled.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_by INTEGER,
+            target TEXT,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            caption TEXT,
+            text TEXT,
+            status TEXT DEFAULT 'running',
+            cursor INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at INTEGER DEFAULT (strftime('%s', 'now'))
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER,
+            user_id INTEGER,
+            status INTEGER DEFAULT 0,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Create relay sessions table (admin -> target group of their live relay)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS relay_sessions (
+            admin_id INTEGER PRIMARY KEY,
+            target TEXT NOT NULL
+        )
+    ''')
+    # Move sessions stored by older versions as relay_target_<id> settings
+    cursor.execute('''
+        INSERT OR IGNORE INTO relay_sessions (admin_id, target)
+        SELECT CAST(SUBSTR(key, 14) AS INTEGER), value FROM settings
+        WHERE key LIKE 'relay\\_target\\_%' ESCAPE '\\' AND value != ''
+    ''')
+    cursor.execute("DELETE FROM settings WHERE key LIKE 'relay\\_target\\_%' ESCAPE '\\'")
+
+def _migration_2(cursor):
+    """Indexes for the language, banned and group membership lookups."""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_language ON users (language_code)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_banned ON users (is_banned)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_groups_group ON user_groups (group_name, user_id)')
+
+def _migration_3(cursor):
+    """Delivery reachability: users who blocked the bot or deleted their account."""
+    cursor.execute('ALTER TABLE users ADD COLUMN is_reachable INTEGER DEFAULT 1')
+    cursor.execute('ALTER TABLE users ADD COLUMN unreachable_since INTEGER')
+
+def _migration_4(cursor):
+    """Conversation states and user_data kept by persistence.py across restarts."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT,
+            key TEXT,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+
+def _migration_5(cursor):
+    """Why each failed broadcast delivery failed, for the per-reason report."""
+    cursor.execute('ALTER TABLE broadcast_recipients ADD COLUMN error TEXT')
+
+def _migration_6(cursor):
+    """Scheduled broadcasts: when a job starts and the window its delivery is spread over."""
+    cursor.execute('ALTER TABLE broadcast_jobs ADD COLUMN scheduled_at INTEGER')
+    cursor.execute('ALTER TABLE broadcast_jobs ADD COLUMN spread INTEGER DEFAULT 0')
+
+def _migration_7(cursor):
+    """Automatic flood bans and when they are lifted."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS flood_bans (
+            user_id INTEGER PRIMARY KEY,
+            until INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_8(cursor):
+    """Failed deliveries ordered by reason, so failure reports page through them without sorting."""
+    # Failures recorded before migration 5 have no reason
+    cursor.execute("UPDATE broadcast_recipients SET error = 'Unknown' WHERE status = 2 AND error IS NULL")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipients_failed
+        ON broadcast_recipients (job_id, error, user_id) WHERE status = 2
+    ''')
+
+# Numbered schema migrations; MIGRATIONS[n - 1] upgrades a database to version n.
+# Append new migrations here and never edit one that has shipped.
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
 
 def init_db():
-    """Initializes the SQLite database and users table with the full user model."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                language_code TEXT DEFAULT 'en',
-                is_premium INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # Migration to add missing columns
-        cursor.execute("PRAGMA table_info(users)")
-        existing_columns = [info[1] for info in cursor.fetchall()]
-        
-        new_columns = {
-            'username': 'TEXT',
-            'first_name': 'TEXT',
-            'last_name': 'TEXT',
-            'language_code': "TEXT DEFAULT 'en'",
-            'is_premium': 'INTEGER DEFAULT 0',
-            'is_banned': 'INTEGER DEFAULT 0'
-        }
-        
-        for column_name, column_type in new_columns.items():
-            if column_name not in existing_columns:
-                cursor.execute(f"ALTER TABLE users ADD COLUMN {column_name} {column_type}")
-        
-        # Create admins table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                admin_id INTEGER PRIMARY KEY
-            )
-        ''')
-        
-        # Create settings table for global bot settings
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-        
-        # Create groups table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups (
-                name TEXT PRIMARY KEY
-            )
-        ''')
-        
-        # Create user_groups mapping table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_groups (
-                user_id INTEGER,
-                group_name TEXT,
-                PRIMARY KEY (user_id, group_name),
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (group_name) REFERENCES groups (name)
-            )
-        ''')
+    """
+    Brings the database schema up to date using the migrations above.
+    The applied version is kept in PRAGMA user_version, so a current
+    database costs a single pragma read.
+    """
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        # WAL is persistent in the database file, so the pool inherits it.
+        conn.execute("PRAGMA journal_mode = WAL")
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            # Each migration and its version bump commit together
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                MIGRATIONS[number - 1](conn.cursor())
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
 
 async def get_user_language(user_id: int) -> str:
     """Fetches the user's language from the DB, defaulting to 'en'."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT language_code FROM users WHERE user_id = ?', (user_id,))
+    lang = state_cache.get(('lang', user_id))
+    if lang is not MISSING:
+        return lang
+    generation = state_cache.generation
+    def query(conn):
+        cursor = conn.execute('SELECT language_code FROM users WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
         return result[0] if result else 'en'
+    lang = await _run(query)
+    state_cache.set(('lang', user_id), lang, generation)
+    return lang
+
+# Profile fingerprints of users known to exist, so /start only writes when
+# something changed. Changed profiles are queued and upserted in batches.
+profile_cache = TTLCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '100000')),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '3600'))
+)
+def _forget_profiles(user_ids):
+    """Drops profile fingerprints here and, in cluster mode, on every other worker."""
+    profile_cache.invalidate(*user_ids)
+    cluster.publish('profiles', user_ids=user_ids)
+
+def _on_profiles(application, user_ids):
+    profile_cache.invalidate(*user_ids)
+
+cluster.subscribe('profiles', _on_profiles)
+
+PROFILE_FLUSH_INTERVAL = float(os.getenv('PROFILE_FLUSH_INTERVAL', '5'))
+PROFILE_FLUSH_BATCH = int(os.getenv('PROFILE_FLUSH_BATCH', '500'))
+
+_pending_profiles = {}
+_profile_flush_task = None
+_profile_flush_now = None
 
 async def check_and_register_user(user) -> bool:
     """
     Checks if a user exists. If not, adds them to the database with full profile.
-    If they exists, it updates their profile. 
+    If they exists, their profile refresh is queued for the next batched write
+    (and skipped entirely when nothing changed).
     Returns True if the user is new.
     """
     user_id = user.id
@@ -87,51 +379,135 @@ async def check_and_register_user(user) -> bool:
     last_name = user.last_name
     language_code = user.language_code or 'en'
     is_premium = 1 if user.is_premium else 0
+    fingerprint = (username, first_name, last_name, is_premium)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
-        exists = cursor.fetchone()
-        
-        if not exists:
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, language_code, is_premium) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name, language_code, is_premium))
-            return True
-        else:
-            # Update existing user info to keep it fresh
-            cursor.execute('''
-                UPDATE users 
-                SET username = ?, first_name = ?, last_name = ?, is_premium = ?
-                WHERE user_id = ?
-            ''', (username, first_name, last_name, is_premium, user_id))
-            return False
+    cached = profile_cache.get(user_id)
+    # Users marked unreachable take the slow path below, which reactivates them
+    if cached is not MISSING and user_id not in audience.index.unreachable:
+        if cached != fingerprint:
+            profile_cache.set(user_id, fingerprint)
+            if cached[3] != is_premium:
+                _index('set_premium', user_id, bool(is_premium))
+            _queue_profile((user_id, username, first_name, last_name, language_code, is_premium))
+        return False
+
+    def query(conn):
+        cursor = conn.execute('''
+            INSERT INTO users (user_id, username, first_name, last_name, language_code, is_premium) 
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO NOTHING
+        ''', (user_id, username, first_name, last_name, language_code, is_premium))
+        if cursor.rowcount > 0:
+            return True, False
+        # Messaging the bot again proves a blocked/deleted user is reachable
+        cursor = conn.execute('''
+            UPDATE users SET is_reachable = 1, unreachable_since = NULL
+            WHERE user_id = ? AND is_reachable = 0
+        ''', (user_id,))
+        return False, cursor.rowcount > 0
+    is_new, reactivated = await _run(query)
+    profile_cache.set(user_id, fingerprint)
+    if reactivated:
+        _index('set_reachable', [user_id])
+    if is_new:
+        # Defaults may have been cached while the user did not exist yet
+        _invalidate(('lang', user_id), ('banned', user_id))
+        _index('add_user', user_id, language_code, bool(is_premium))
+    else:
+        # Known user we have no fingerprint for: refresh to keep it fresh
+        _queue_profile((user_id, username, first_name, last_name, language_code, is_premium))
+        # Profile writes are batched, so a load in progress may not see this one; apply() replays it
+        index = audience.index
+        if index.loading or (index.loaded and (user_id in index.premium) != bool(is_premium)):
+            _index('set_premium', user_id, bool(is_premium))
+    return is_new
+
+def _queue_profile(row):
+    global _profile_flush_task, _profile_flush_now
+    _pending_profiles[row[0]] = row
+    if _profile_flush_task is None or _profile_flush_task.done():
+        _profile_flush_now = asyncio.Event()
+        _profile_flush_task = asyncio.create_task(_profile_flusher())
+    if len(_pending_profiles) >= PROFILE_FLUSH_BATCH:
+        _profile_flush_now.set()
+
+async def _profile_flusher():
+    while _pending_profiles:
+        try:
+            await asyncio.wait_for(_profile_flush_now.wait(), PROFILE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _profile_flush_now.clear()
+        try:
+            await flush_profiles()
+        except Exception as e:
+            logger.error(f"Failed to write {len(_pending_profiles)} profile updates: {e}")
+            await asyncio.sleep(PROFILE_FLUSH_INTERVAL)
+
+async def flush_profiles():
+    """Writes every queued profile refresh in one executemany UPSERT."""
+    if not _pending_profiles:
+        return
+    rows = list(_pending_profiles.values())
+    _pending_profiles.clear()
+    def query(conn):
+        conn.executemany('''
+            INSERT INTO users (user_id, username, first_name, last_name, language_code, is_premium) 
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                is_premium = excluded.is_premium
+        ''', rows)
+    try:
+        await _run(query)
+    except Exception:
+        # Keep the batch for the next flush unless a newer refresh replaced it
+        for row in rows:
+            _pending_profiles.setdefault(row[0], row)
+        raise
 
 async def update_user_language(user_id: int, new_lang: str):
     """Updates the user's language preference in the database."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET language_code = ? WHERE user_id = ?', (new_lang, user_id))
+    def query(conn):
+        conn.execute('UPDATE users SET language_code = ? WHERE user_id = ?', (new_lang, user_id))
+    await _run(query)
+    _invalidate(('lang', user_id))
+    _index('set_language', user_id, new_lang)
 
-async def get_all_users():
-    """Returns a list of all registered user IDs."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users')
-        return [row[0] for row in cursor.fetchall()]
+async def _iter_keyset(sql: str, params: tuple = (), chunk_size: int = None, row_factory=None, after: int = -1):
+    """
+    Pages through a query by user_id so only one chunk is in memory at a time.
+    The query must select user_id first, filter on `user_id > ?`, order by
+    user_id and end with `LIMIT ?`; those two values are appended to params.
+    """
+    chunk_size = chunk_size or RECIPIENT_CHUNK_SIZE
+    while True:
+        def query(conn):
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            cursor.execute(sql, (*params, after, chunk_size))
+            return cursor.fetchall()
+        rows = await _run(query)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
 
 async def get_user_profile(user_id: int):
     """Returns the full profile of a user."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
+    def query(conn):
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
         return cursor.fetchone()
+    return await _run(query)
 
 async def add_admin(admin_id: int):
     """Adds an admin to the admins table."""
-    with sqlite3.connect(DB_PATH) as conn:
+    def query(conn):
         cursor = conn.cursor()
         # Check if already admin
         cursor.execute('SELECT 1 FROM admins WHERE admin_id = ?', (admin_id,))
@@ -139,108 +515,476 @@ async def add_admin(admin_id: int):
             return False  # Already an admin
         cursor.execute('INSERT INTO admins (admin_id) VALUES (?)', (admin_id,))
         return True  # Successfully added
+    added = await _run(query)
+    _invalidate(('admin', admin_id))
+    return added
 
 async def remove_admin(admin_id: int):
     """Removes an admin from the admins table."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM admins WHERE admin_id = ?', (admin_id,))
+    def query(conn):
+        cursor = conn.execute('DELETE FROM admins WHERE admin_id = ?', (admin_id,))
         return cursor.rowcount > 0  # Returns True if an admin was deleted
+    removed = await _run(query)
+    _invalidate(('admin', admin_id))
+    return removed
 
 async def get_all_admins():
     """Returns a list of all admin IDs."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT admin_id FROM admins')
+    def query(conn):
+        cursor = conn.execute('SELECT admin_id FROM admins')
         return [row[0] for row in cursor.fetchall()]
+    return await _run(query)
 
 async def is_admin_in_db(user_id: int):
     """Checks if a user is an admin."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1 FROM admins WHERE admin_id = ?', (user_id,))
+    is_admin = state_cache.get(('admin', user_id))
+    if is_admin is not MISSING:
+        return is_admin
+    generation = state_cache.generation
+    def query(conn):
+        cursor = conn.execute('SELECT 1 FROM admins WHERE admin_id = ?', (user_id,))
         return cursor.fetchone() is not None
+    is_admin = await _run(query)
+    state_cache.set(('admin', user_id), is_admin, generation)
+    return is_admin
 
 async def get_setting(key: str, default: str = None):
     """Gets a setting value from the settings table."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        result = cursor.fetchone()
-        return result[0] if result else default
+    value = state_cache.get(('setting', key))
+    if value is MISSING:
+        generation = state_cache.generation
+        def query(conn):
+            cursor = conn.execute('SELECT value FROM settings WHERE key = ?', (key,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+        value = await _run(query)
+        state_cache.set(('setting', key), value, generation)
+    return value if value is not None else default
 
 async def set_setting(key: str, value: str):
     """Sets a setting value in the settings table."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+    def query(conn):
+        conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+    await _run(query)
+    _invalidate(('setting', key))
 
-async def get_users_by_filter(filter_type: str, filter_value: str = None):
-    """Returns users based on a filter."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        if filter_type == "all":
-            cursor.execute('SELECT * FROM users')
-        elif filter_type == "banned":
-            cursor.execute('SELECT * FROM users WHERE is_banned = 1')
-        elif filter_type == "lang":
-            cursor.execute('SELECT * FROM users WHERE language_code = ?', (filter_value,))
-        return [dict(row) for row in cursor.fetchall()]
+def _user_filter(filter_type: str, filter_value: str = None):
+    """Returns the WHERE condition and params for a users filter."""
+    if filter_type == "banned":
+        return 'is_banned = 1', ()
+    elif filter_type == "lang":
+        return 'language_code = ?', (filter_value,)
+    elif filter_type == "unreachable":
+        return 'is_reachable = 0', ()
+    return '1', ()
+
+async def count_users_by_filter(filter_type: str, filter_value: str = None) -> int:
+    """Counts the users matching a filter."""
+    where, params = _user_filter(filter_type, filter_value)
+    def query(conn):
+        return conn.execute(f'SELECT COUNT(*) FROM users WHERE {where}', params).fetchone()[0]
+    return await _run(query)
+
+async def get_users_page(filter_type: str, filter_value: str = None, offset: int = 0, limit: int = 50):
+    """Returns one page of (user_id, first_name, username) rows matching a filter."""
+    where, params = _user_filter(filter_type, filter_value)
+    def query(conn):
+        cursor = conn.execute(
+            f'SELECT user_id, first_name, username FROM users WHERE {where} ORDER BY user_id LIMIT ? OFFSET ?',
+            (*params, limit, offset)
+        )
+        return cursor.fetchall()
+    return await _run(query)
 
 async def toggle_user_ban(user_id: int, ban: bool):
     """Bans or unbans a user."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET is_banned = ? WHERE user_id = ?', (1 if ban else 0, user_id))
+    def query(conn):
+        cursor = conn.execute('UPDATE users SET is_banned = ? WHERE user_id = ?', (1 if ban else 0, user_id))
         return cursor.rowcount > 0
+    changed = await _run(query)
+    _invalidate(('banned', user_id))
+    if changed:
+        _index('set_banned', user_id, ban)
+    return changed
 
 async def is_user_banned(user_id: int):
     """Checks if a user is banned."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
+    banned = state_cache.get(('banned', user_id))
+    if banned is not MISSING:
+        return banned
+    generation = state_cache.generation
+    def query(conn):
+        cursor = conn.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
         return result[0] == 1 if result else False
+    banned = await _run(query)
+    state_cache.set(('banned', user_id), banned, generation)
+    return banned
 
 async def add_group(name: str):
     """Creates a new group."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+    def query(conn):
         try:
-            cursor.execute('INSERT INTO groups (name) VALUES (?)', (name,))
+            conn.execute('INSERT INTO groups (name) VALUES (?)', (name,))
             return True
         except sqlite3.IntegrityError:
             return False
+    created = await _run(query)
+    if created:
+        _index('add_group', name)
+    return created
 
 async def remove_group(name: str):
     """Removes a group and its mappings."""
-    with sqlite3.connect(DB_PATH) as conn:
+    def query(conn):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM user_groups WHERE group_name = ?', (name,))
         cursor.execute('DELETE FROM groups WHERE name = ?', (name,))
         return cursor.rowcount > 0
+    removed = await _run(query)
+    if removed:
+        _index('remove_group', name)
+    return removed
 
 async def get_all_groups():
     """Returns all group names."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT name FROM groups')
-        return [row[0] for row in cursor.fetchall()]
-
-async def get_users_in_group(group_name: str):
-    """Returns all user IDs in a specific group."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM user_groups WHERE group_name = ?', (group_name,))
+    def query(conn):
+        cursor = conn.execute('SELECT name FROM groups')
         return [row[0] for row in cursor.fetchall()]
+    return await _run(query)
 
 async def add_user_to_group(user_id: int, group_name: str):
     """Adds a user to a group."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+    def query(conn):
         try:
-            cursor.execute('INSERT INTO user_groups (user_id, group_name) VALUES (?, ?)', (user_id, group_name))
+            conn.execute('INSERT INTO user_groups (user_id, group_name) VALUES (?, ?)', (user_id, group_name))
             return True
         except sqlite3.IntegrityError:
             return False
+    added = await _run(query)
+    if added:
+        _index('add_to_group', user_id, group_name)
+    return added
+
+# Stays under SQLite's bound-parameter limit on older builds
+_IN_BATCH = 500
+
+async def add_users_to_group(group_name: str, user_ids) -> tuple:
+    """
+    Adds a batch of users to a group in one transaction. IDs that are not in
+    users are skipped. Returns (added, already_members, unknown_ids).
+    """
+    ids = list(dict.fromkeys(user_ids))
+    def query(conn):
+        known = set()
+        for i in range(0, len(ids), _IN_BATCH):
+            batch = ids[i:i + _IN_BATCH]
+            marks = ",".join("?" * len(batch))
+            known.update(row[0] for row in conn.execute(f'SELECT user_id FROM users WHERE user_id IN ({marks})', batch))
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO user_groups (user_id, group_name) VALUES (?, ?)',
+                         ((user_id, group_name) for user_id in ids if user_id in known))
+        return known, conn.total_changes - before
+    known, added = await _run(query)
+    if added:
+        _index('add_members', group_name, list(known))
+    return added, len(known) - added, [user_id for user_id in ids if user_id not in known]
+
+async def iter_group_members(group_name: str, chunk_size: int = None):
+    """Yields (user_id, username, first_name) for a group's members in ascending order."""
+    sql = '''
+        SELECT ug.user_id, u.username, u.first_name FROM user_groups ug
+        LEFT JOIN users u ON u.user_id = ug.user_id
+        WHERE ug.group_name = ? AND ug.user_id > ? ORDER BY ug.user_id LIMIT ?
+    '''
+    async for row in _iter_keyset(sql, (group_name,), chunk_size):
+        yield row
+
+async def mark_unreachable(user_ids) -> int:
+    """Flags users that blocked the bot or deleted their account. Returns how many changed."""
+    ids = list(user_ids)
+    def query(conn):
+        cursor = conn.executemany('''
+            UPDATE users SET is_reachable = 0, unreachable_since = strftime('%s', 'now')
+            WHERE user_id = ? AND is_reachable = 1
+        ''', ((user_id,) for user_id in ids))
+        return cursor.rowcount
+    changed = await _run(query)
+    # Their next /start, on whichever worker, must reach the database to reactivate them
+    _forget_profiles(ids)
+    _index('set_unreachable', ids)
+    return changed
+
+async def reactivate_user(user_id: int) -> bool:
+    """
+    Clears the unreachable flag of a user who contacted the bot again. Returns
+    True if it was set. Only users in the loaded audience index's unreachable
+    set reach the database, so this is free for everyone else; before the index
+    has loaded, the /start path in check_and_register_user still reactivates.
+    """
+    if user_id not in audience.index.unreachable:
+        return False
+    def query(conn):
+        cursor = conn.execute('''
+            UPDATE users SET is_reachable = 1, unreachable_since = NULL
+            WHERE user_id = ? AND is_reachable = 0
+        ''', (user_id,))
+        return cursor.rowcount > 0
+    reactivated = await _run(query)
+    # Also drops the ID when another worker already cleared the flag
+    _index('set_reachable', [user_id])
+    return reactivated
+
+async def get_reachability_stats() -> dict:
+    """Counts of all, reachable, unreachable and banned users."""
+    def query(conn):
+        cursor = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(is_reachable = 0), 0), COALESCE(SUM(is_banned = 1), 0) FROM users
+        ''')
+        total, unreachable, banned = cursor.fetchone()
+        return {'total': total, 'reachable': total - unreachable, 'unreachable': unreachable, 'banned': banned}
+    return await _run(query)
+
+_audience_lock = asyncio.Lock()
+
+async def get_audience_index() -> audience.AudienceIndex:
+    """Returns the audience membership sets, reading them from the database on first use."""
+    index = audience.index
+    if index.loaded:
+        return index
+    async with _audience_lock:
+        if index.loaded:
+            return index
+        def query(conn):
+            users, banned, premium, unreachable, languages, groups = set(), set(), set(), set(), {}, {}
+            for user_id, language, is_premium, is_banned, is_reachable in conn.execute(
+                    'SELECT user_id, language_code, is_premium, is_banned, is_reachable FROM users'):
+                users.add(user_id)
+                if is_reachable == 0:
+                    unreachable.add(user_id)
+                languages.setdefault(language or 'en', set()).add(user_id)
+                if is_premium:
+                    premium.add(user_id)
+                if is_banned:
+                    banned.add(user_id)
+            for (name,) in conn.execute('SELECT name FROM groups'):
+                groups[name] = set()
+            for user_id, name in conn.execute('SELECT user_id, group_name FROM user_groups'):
+                groups.setdefault(name, set()).add(user_id)
+            return users, banned, premium, unreachable, languages, groups
+        index.begin_load()
+        try:
+            # Batched profile refreshes go in first, so the sets include them
+            await flush_profiles()
+            index.finish_load(*await _run(query))
+        except Exception:
+            index.abort_load()
+            raise
+        logger.info(f"Audience index loaded: {len(index.users)} users, {len(index.groups)} groups")
+    return index
+
+# Delivery states stored in broadcast_recipients.status
+DELIVERY_PENDING, DELIVERY_SENT, DELIVERY_FAILED = 0, 1, 2
+
+async def create_broadcast_job(created_by: int, target: str, user_ids=None, from_chat_id: int = None,
+                               message_id: int = None, caption: str = None, text: str = None,
+                               status_chat_id: int = None, status_message_id: int = None,
+                               scheduled_at: int = None, spread: int = 0):
+    """
+    Saves a broadcast job with a snapshot of its recipients: `user_ids` in
+    ascending order (e.g. a resolved audience), or every reachable, unbanned
+    user when it is None. A job with a future `scheduled_at` (epoch seconds) waits
+    in the 'scheduled' status; `spread` paces delivery over that many seconds.
+    Returns (job_id, total).
+    """
+    status = 'scheduled' if scheduled_at and scheduled_at > time.time() else 'running'
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO broadcast_jobs (created_by, target, from_chat_id, message_id, caption, text,
+                                        status_chat_id, status_message_id, status, scheduled_at, spread)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (created_by, target, from_chat_id, message_id, caption, text,
+              status_chat_id, status_message_id, status, scheduled_at or int(time.time()), spread))
+        job_id = cursor.lastrowid
+        if user_ids is None:
+            cursor.execute('''
+                INSERT INTO broadcast_recipients (job_id, user_id)
+                SELECT ?, user_id FROM users WHERE is_banned = 0 AND is_reachable = 1
+            ''', (job_id,))
+            total = cursor.rowcount
+        else:
+            # Ascending inserts append to the primary key b-tree instead of splitting pages;
+            # rows are built one chunk at a time
+            total = 0
+            for start in range(0, len(user_ids), RECIPIENT_CHUNK_SIZE):
+                chunk = user_ids[start:start + RECIPIENT_CHUNK_SIZE]
+                cursor.executemany('INSERT INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)',
+                                   [(job_id, user_id) for user_id in chunk])
+                total += cursor.rowcount
+        cursor.execute('UPDATE broadcast_jobs SET total = ? WHERE job_id = ?', (total, job_id))
+        return job_id, total
+    return await _run(query)
+
+async def get_broadcast_job(job_id: int):
+    """Returns a broadcast job row, or None."""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('SELECT * FROM broadcast_jobs WHERE job_id = ?', (job_id,))
+        return cursor.fetchone()
+    return await _run(query)
+
+async def get_broadcast_jobs(statuses=None, limit: int = 20):
+    """Returns the most recent broadcast jobs, optionally filtered by status."""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        if statuses:
+            marks = ",".join("?" * len(statuses))
+            cursor.execute(f'SELECT * FROM broadcast_jobs WHERE status IN ({marks}) ORDER BY job_id DESC LIMIT ?',
+                           (*statuses, limit))
+        else:
+            cursor.execute('SELECT * FROM broadcast_jobs ORDER BY job_id DESC LIMIT ?', (limit,))
+        return cursor.fetchall()
+    return await _run(query)
+
+async def iter_pending_recipients(job_id: int, after: int = 0, chunk_size: int = None):
+    """Yields the user IDs still waiting for delivery in a job, past the cursor."""
+    sql = '''
+        SELECT user_id FROM broadcast_recipients
+        WHERE job_id = ? AND status = ? AND user_id > ?
+        ORDER BY user_id LIMIT ?
+    '''
+    async for row in _iter_keyset(sql, (job_id, DELIVERY_PENDING), chunk_size, after=after):
+        yield row[0]
+
+async def save_broadcast_progress(job_id: int, outcomes, cursor_pos: int, sent: int, failed: int):
+    """Writes a batch of (user_id, status, error) outcomes and advances the job checkpoint."""
+    def query(conn):
+        conn.executemany('UPDATE broadcast_recipients SET status = ?, error = ? WHERE job_id = ? AND user_id = ?',
+                         ((status, error, job_id, u_id) for u_id, status, error in outcomes))
+        conn.execute('''
+            UPDATE broadcast_jobs SET cursor = MAX(cursor, ?), sent = sent + ?, failed = failed + ?
+            WHERE job_id = ?
+        ''', (cursor_pos, sent, failed, job_id))
+    await _run(query)
+
+async def get_failure_counts(job_id: int) -> dict:
+    """Returns a job's failed deliveries counted by error reason."""
+    def query(conn):
+        cursor = conn.execute('''
+            SELECT COALESCE(error, 'Unknown'), COUNT(*) FROM broadcast_recipients
+            WHERE job_id = ? AND status = ? GROUP BY 1
+        ''', (job_id, DELIVERY_FAILED))
+        return dict(cursor.fetchall())
+    return await _run(query)
+
+async def iter_failed_recipients(job_id: int, chunk_size: int = None):
+    """
+    Yields (user_id, error) for every failed delivery of a job, ordered by
+    error and then user_id. Pages on that pair through idx_recipients_failed.
+    """
+    chunk_size = chunk_size or RECIPIENT_CHUNK_SIZE
+    # The status is inlined so SQLite can use the partial index
+    sql = f'''
+        SELECT user_id, error FROM broadcast_recipients
+        WHERE job_id = ? AND status = {DELIVERY_FAILED} AND (error, user_id) > (?, ?)
+        ORDER BY error, user_id LIMIT ?
+    '''
+    after = ('', -1)
+    while True:
+        def query(conn):
+            return conn.execute(sql, (job_id, *after, chunk_size)).fetchall()
+        rows = await _run(query)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        user_id, error = rows[-1]
+        after = (error, user_id)
+
+async def set_broadcast_job_status(job_id: int, status: str, expected: str = None):
+    """
+    Updates a job's status. Returns True if the job exists (and, when
+    `expected` is given, only if the job was in that status).
+    """
+    def query(conn):
+        if expected is None:
+            cursor = conn.execute('UPDATE broadcast_jobs SET status = ? WHERE job_id = ?', (status, job_id))
+        else:
+            cursor = conn.execute('UPDATE broadcast_jobs SET status = ? WHERE job_id = ? AND status = ?',
+                                  (status, job_id, expected))
+        return cursor.rowcount > 0
+    return await _run(query)
+
+async def get_relay_sessions():
+    """Returns all active relay sessions as a dict of admin_id -> target group."""
+    def query(conn):
+        cursor = conn.execute('SELECT admin_id, target FROM relay_sessions')
+        return dict(cursor.fetchall())
+    return await _run(query)
+
+async def set_relay_session(admin_id: int, target: str):
+    """Starts or replaces an admin's relay session."""
+    def query(conn):
+        conn.execute('INSERT OR REPLACE INTO relay_sessions (admin_id, target) VALUES (?, ?)', (admin_id, target))
+    await _run(query)
+
+async def delete_relay_session(admin_id: int):
+    """Ends an admin's relay session. Returns True if one was active."""
+    def query(conn):
+        cursor = conn.execute('DELETE FROM relay_sessions WHERE admin_id = ?', (admin_id,))
+        return cursor.rowcount > 0
+    return await _run(query)
+
+async def get_flood_bans():
+    """Returns every automatic flood ban as a dict of user_id -> epoch seconds it ends."""
+    def query(conn):
+        cursor = conn.execute('SELECT user_id, until FROM flood_bans')
+        return dict(cursor.fetchall())
+    return await _run(query)
+
+async def set_flood_ban(user_id: int, until: int):
+    """Records that a user's ban was automatic and ends at `until`."""
+    def query(conn):
+        conn.execute('INSERT OR REPLACE INTO flood_bans (user_id, until) VALUES (?, ?)', (user_id, until))
+    await _run(query)
+
+async def delete_flood_ban(user_id: int):
+    """Forgets a user's automatic ban. Returns True if there was one."""
+    def query(conn):
+        cursor = conn.execute('DELETE FROM flood_bans WHERE user_id = ?', (user_id,))
+        return cursor.rowcount > 0
+    return await _run(query)
+
+async def get_persisted_user_data():
+    """Returns every stored user_data as a dict of user_id -> JSON text."""
+    def query(conn):
+        cursor = conn.execute('SELECT user_id, data FROM persisted_user_data')
+        return dict(cursor.fetchall())
+    return await _run(query)
+
+async def get_persisted_conversations(name: str):
+    """Returns a conversation handler's stored states as a dict of JSON key -> JSON state."""
+    def query(conn):
+        cursor = conn.execute('SELECT key, state FROM persisted_conversations WHERE name = ?', (name,))
+        return dict(cursor.fetchall())
+    return await _run(query)
+
+async def save_persisted_state(user_data, conversations):
+    """
+    Writes changed user_data ((user_id, data) pairs) and conversation states
+    ((name, key, state) triples) in one transaction. A None data or state
+    deletes the row.
+    """
+    def query(conn):
+        conn.executemany('DELETE FROM persisted_user_data WHERE user_id = ?',
+                         ((u_id,) for u_id, data in user_data if data is None))
+        conn.executemany('INSERT OR REPLACE INTO persisted_user_data (user_id, data) VALUES (?, ?)',
+                         ((u_id, data) for u_id, data in user_data if data is not None))
+        conn.executemany('DELETE FROM persisted_conversations WHERE name = ? AND key = ?',
+                         ((name, key) for name, key, state in conversations if state is None))
+        conn.executemany('INSERT OR REPLACE INTO persisted_conversations (name, key, state) VALUES (?, ?, ?)',
+                         (row for row in conversations if row[2] is not None))
+    await _run(query)
@@ -0,0 +1,165 @@
+"""
+A local stand-in for the Telegram Bot API, for load tests and offline runs.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081/bot and any
+token. Updates queued with `FakeBotAPI.push_update` (or POSTed to /control/updates)
+are served through getUpdates.
+
+    python fake_api.py --port 8081 --latency 0.05 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+# Parameters that are always strings, even when they look like JSON
+_TEXT_PARAMS = {'text', 'caption', 'callback_query_id', 'secret_token', 'url'}
+
+def _parse_params(request: httpserver.Request) -> dict:
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return request.json() or {}
+    params = dict(request.query)
+    params.update(parse_qsl(request.body.decode('utf-8'), keep_blank_values=True))
+    # PTB JSON-encodes every non-string value in form bodies
+    for name, value in params.items():
+        if name not in _TEXT_PARAMS:
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+class FakeBotAPI:
+    """Serves the handful of Bot API methods this bot uses, with optional latency and 429s."""
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.floods = 0
+        self.updates = asyncio.Queue()
+        self._update_id = 0
+        self._message_id = 0
+        self._server = None
+        self.methods = {
+            'getme': self.get_me,
+            'getupdates': self.get_updates,
+            'sendmessage': self.send_message,
+            'copymessage': self.copy_message,
+            'copymessages': self.copy_messages,
+            'editmessagetext': self.edit_message_text,
+            'answercallbackquery': lambda params: True,
+            'setmycommands': lambda params: True,
+            'deletemessage': lambda params: True,
+            'deletewebhook': lambda params: True,
+            'setwebhook': lambda params: True,
+        }
+
+    def push_update(self, update: dict):
+        """Queues an update (without update_id) for getUpdates."""
+        self._update_id += 1
+        self.updates.put_nowait({**update, 'update_id': self._update_id})
+
+    def _message(self, chat_id, **fields) -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, **fields}
+
+    def get_me(self, params):
+        return BOT_USER
+
+    async def get_updates(self, params):
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        while len(updates) < limit and not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    def send_message(self, params):
+        return self._message(params['chat_id'], text=str(params.get('text', '')))
+
+    def copy_message(self, params):
+        self._message_id += 1
+        return {"message_id": self._message_id}
+
+    def copy_messages(self, params):
+        return [self.copy_message(params) for _ in params.get('message_ids', [])]
+
+    def edit_message_text(self, params):
+        if 'inline_message_id' in params:
+            return True
+        return self._message(params['chat_id'], text=str(params.get('text', '')),
+                             message_id=params.get('message_id'))
+
+    async def handle(self, request: httpserver.Request) -> httpserver.Response:
+        if request.path == '/control/updates' and request.method == 'POST':
+            self.push_update(request.json())
+            return httpserver.Response.json({"ok": True})
+        if request.path == '/control/stats':
+            return httpserver.Response.json({"calls": self.calls, "floods": self.floods})
+
+        # /bot<token>/<method>
+        method = request.path.rsplit('/', 1)[-1]
+        name = method.lower()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name != 'getupdates' and self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return httpserver.Response.json({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status=429)
+
+        handler = self.methods.get(name)
+        if handler is None:
+            return httpserver.Response.json({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        result = handler(_parse_params(request))
+        if asyncio.iscoroutine(result):
+            result = await result
+        return httpserver.Response.json({"ok": True, "result": result})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081):
+        self._server = await httpserver.serve(self.handle, host, port)
+        return self._server
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+async def _serve_forever(args):
+    api = FakeBotAPI(args.latency, args.flood_rate)
+    await api.start(args.host, args.port)
+    logger.info(f"Fake Bot API listening on http://{args.host}:{args.port}/bot")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake Telegram Bot API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of calls answered with 429")
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    try:
+        asyncio.run(_serve_forever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
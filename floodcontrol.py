@@ -0,0 +1,168 @@
+"""
+Inbound flood control. A TypeHandler in an early handler group gives each user
+a token bucket per kind of update (command, button, other message) and drops
+updates over the limit with ApplicationHandlerStop, before any other handler
+or database query runs. Admins are exempt. Users get one warning per burst of
+dropped updates; FLOOD_MAX_STRIKES such bursts within FLOOD_STRIKE_WINDOW
+seconds ban them with toggle_user_ban for FLOOD_BAN_SECONDS.
+
+Limits are "<per minute>/<burst>", e.g. FLOOD_MESSAGE_LIMIT=30/10.
+"""
+import logging
+import os
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from cache import TTLCache, MISSING
+from database import (
+    toggle_user_ban, is_user_banned, get_user_language,
+    get_flood_bans, set_flood_ban, delete_flood_ban
+)
+from commands import is_admin, get_message
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def _limit(name: str, default: str) -> tuple:
+    per_minute, burst = os.getenv(name, default).split('/')
+    return float(per_minute) / 60, float(burst)
+
+# kind -> (tokens per second, bucket size)
+FLOOD_LIMITS = {
+    'command': _limit('FLOOD_COMMAND_LIMIT', '20/8'),
+    'callback': _limit('FLOOD_CALLBACK_LIMIT', '60/15'),
+    'message': _limit('FLOOD_MESSAGE_LIMIT', '30/10'),
+}
+FLOOD_MAX_STRIKES = int(os.getenv('FLOOD_MAX_STRIKES', '3'))
+FLOOD_STRIKE_WINDOW = float(os.getenv('FLOOD_STRIKE_WINDOW', '600'))
+FLOOD_BAN_SECONDS = int(os.getenv('FLOOD_BAN_SECONDS', '900'))
+
+# Idle buckets are full again long before they expire, so forgetting them changes nothing
+_buckets = TTLCache(maxsize=100000, ttl=600)
+# user_id -> times of recent strikes
+_strikes = TTLCache(maxsize=10000, ttl=FLOOD_STRIKE_WINDOW)
+
+class _Bucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'limited')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # True from the first dropped update until one gets through again
+        self.limited = False
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+def update_kind(update: Update):
+    """'command', 'callback' or 'message', or None for updates that are not limited."""
+    if update.callback_query:
+        return 'callback'
+    message = update.message or update.edited_message
+    if message is None:
+        return None
+    text = message.text or ''
+    return 'command' if text.startswith('/') else 'message'
+
+async def limit(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler for the flood control group; stops over-limit updates from reaching any other handler."""
+    if not isinstance(update, Update) or update.effective_user is None:
+        return
+    kind = update_kind(update)
+    if kind is None:
+        return
+    user_id = update.effective_user.id
+    key = (user_id, kind)
+    bucket = _buckets.get(key)
+    if bucket is MISSING:
+        bucket = _Bucket(*FLOOD_LIMITS[kind])
+    _buckets.set(key, bucket)
+    if bucket.take():
+        bucket.limited = False
+        return
+    # Only users over the limit pay for the (cached) admin lookup
+    if await is_admin(user_id):
+        return
+    metrics.updates_dropped.inc(kind)
+    if not bucket.limited:
+        bucket.limited = True
+        await _strike(update, context, user_id)
+    raise ApplicationHandlerStop
+
+async def _strike(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Warns about the first dropped update of a burst, and bans after FLOOD_MAX_STRIKES bursts."""
+    # Banned users get no replies anyway, and an admin's ban is never turned into a temporary one
+    if await is_user_banned(user_id):
+        return
+    strikes = _strikes.get(user_id)
+    if strikes is MISSING:
+        strikes = deque()
+    now = time.monotonic()
+    strikes.append(now)
+    while strikes[0] < now - FLOOD_STRIKE_WINDOW:
+        strikes.popleft()
+    _strikes.set(user_id, strikes)
+
+    if len(strikes) >= FLOOD_MAX_STRIKES:
+        _strikes.invalidate(user_id)
+        if await ban(context, user_id):
+            await _notify(update, 'flood_banned', minutes=-(-FLOOD_BAN_SECONDS // 60))
+            return
+    await _notify(update, 'flood_warning')
+
+async def _notify(update: Update, key: str, **fields):
+    text = get_message(await get_user_language(update.effective_user.id), key).format(**fields)
+    try:
+        if update.callback_query:
+            # Alerts are plain text
+            await update.callback_query.answer(text.replace('<b>', '').replace('</b>', ''), show_alert=True)
+        else:
+            await update.effective_message.reply_text(text, parse_mode='HTML')
+    except TelegramError as e:
+        logger.warning(f"Failed to send flood notice to {update.effective_user.id}: {e}")
+
+async def ban(context: ContextTypes.DEFAULT_TYPE, user_id: int, seconds: int = FLOOD_BAN_SECONDS) -> bool:
+    """Bans a user automatically and lifts the ban after `seconds`. Returns False for unknown users."""
+    until = int(time.time()) + seconds
+    if not await toggle_user_ban(user_id, True):
+        return False
+    await set_flood_ban(user_id, until)
+    metrics.flood_bans.inc()
+    logger.warning(f"Banned {user_id} for {seconds}s for flooding")
+    _schedule_unban(context.job_queue, user_id, until)
+    return True
+
+def _schedule_unban(job_queue, user_id: int, until: int):
+    if job_queue is None:
+        logger.error(f"JobQueue unavailable; the flood ban of {user_id} ends on the first start after it expires")
+        return
+    job_queue.run_once(_lift, max(0.0, until - time.time()), data=user_id, name=f"flood-unban-{user_id}")
+
+async def _lift(context: ContextTypes.DEFAULT_TYPE):
+    await lift(context.job.data)
+
+async def lift(user_id: int):
+    """Ends an automatic ban. Does nothing if an admin banned or unbanned the user meanwhile."""
+    if await delete_flood_ban(user_id):
+        await toggle_user_ban(user_id, False)
+        logger.info(f"Lifted the flood ban of {user_id}")
+
+async def restore_bans(job_queue):
+    """Schedules the end of every automatic ban after a restart; overdue ones end at once."""
+    for user_id, until in (await get_flood_bans()).items():
+        if until <= time.time():
+            await lift(user_id)
+        else:
+            _schedule_unban(job_queue, user_id, until)
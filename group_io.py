@@ -0,0 +1,122 @@
+import csv
+import html
+import io
+import logging
+import os
+import re
+import time
+
+from database import add_users_to_group, iter_group_members
+
+logger = logging.getLogger(__name__)
+
+# IDs validated and inserted per transaction
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '5000'))
+# Seconds between progress edits of the status message
+IMPORT_PROGRESS_INTERVAL = float(os.getenv('IMPORT_PROGRESS_INTERVAL', '2'))
+# Bots can only download files up to 20 MB
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+
+# Unregistered IDs listed in the summary
+UNKNOWN_SAMPLE_SIZE = 10
+
+_SEPARATORS = re.compile(r'[,;\t ]')
+
+class ImportReport:
+    """Running totals of a group import."""
+
+    def __init__(self, group_name: str):
+        self.group_name = group_name
+        self.lines = 0
+        self.added = 0
+        self.existing = 0
+        self.unknown_count = 0
+        # The first few unregistered IDs, shown in the summary
+        self.unknown_sample = []
+        self.invalid = 0
+        self.started = time.monotonic()
+
+    def progress_text(self) -> str:
+        return (
+            f"📥 Importing into <b>{html.escape(self.group_name)}</b>...\n\n"
+            f"Lines read: {self.lines}\n"
+            f"✅ Added: {self.added}"
+        )
+
+    def summary_text(self) -> str:
+        text = (
+            f"✅ <b>Import into {html.escape(self.group_name)} finished</b> in {time.monotonic() - self.started:.1f}s\n\n"
+            f"Lines read: {self.lines}\n"
+            f"➕ Added: {self.added}\n"
+            f"🔁 Already members: {self.existing}\n"
+            f"❓ Unknown users: {self.unknown_count}\n"
+            f"⚠️ Invalid lines: {self.invalid}"
+        )
+        if self.unknown_count:
+            sample = ", ".join(str(user_id) for user_id in self.unknown_sample)
+            more = ' ...' if self.unknown_count > len(self.unknown_sample) else ''
+            text += f"\n\n<i>Not registered with the bot: {sample}{more}</i>"
+        return text
+
+def parse_user_id(line: str):
+    """The user ID in the first column of a CSV/TXT line, or None (headers, blanks, junk)."""
+    field = _SEPARATORS.split(line.strip(), 1)[0].strip('"\'')
+    if field.lstrip('-').isdigit():
+        return int(field)
+    return None
+
+async def import_members(stream, group_name: str, on_progress=None) -> ImportReport:
+    """
+    Reads user IDs line by line from a binary stream and adds them to a group,
+    one chunk per transaction. A header line is skipped. `on_progress(report)` is awaited at most every
+    IMPORT_PROGRESS_INTERVAL seconds.
+    """
+    report = ImportReport(group_name)
+    chunk = []
+    last_progress = time.monotonic()
+
+    async def flush():
+        added, existing, unknown = await add_users_to_group(group_name, chunk)
+        report.added += added
+        report.existing += existing
+        report.unknown_count += len(unknown)
+        report.unknown_sample.extend(unknown[:UNKNOWN_SAMPLE_SIZE - len(report.unknown_sample)])
+        chunk.clear()
+
+    first = True
+    for line in io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace'):
+        if not line.strip():
+            continue
+        user_id = parse_user_id(line)
+        # A non-numeric first line is a header, e.g. the one export_members writes
+        if first and user_id is None:
+            first = False
+            continue
+        first = False
+        report.lines += 1
+        if user_id is None:
+            report.invalid += 1
+            continue
+        chunk.append(user_id)
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush()
+            if on_progress and time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await on_progress(report)
+    if chunk:
+        await flush()
+    logger.info(f"Imported {report.added} users into group {group_name} ({report.lines} lines)")
+    return report
+
+async def export_members(group_name: str) -> tuple:
+    """Writes a group's members as CSV. Returns (file, member count); the file re-imports as is."""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(['user_id', 'username', 'first_name'])
+    count = 0
+    async for user_id, username, first_name in iter_group_members(group_name):
+        writer.writerow([user_id, username or '', first_name or ''])
+        count += 1
+    data = io.BytesIO(text.getvalue().encode('utf-8'))
+    data.name = f"{group_name}.csv"
+    return data, count
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit, parse_qsl
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 4 * 1024 * 1024
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+           404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class Request:
+    def __init__(self, method: str, target: str, headers: dict, body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+class Response:
+    def __init__(self, status: int = 200, body=b'', content_type: str = 'text/plain; charset=utf-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data, status: int = 200):
+        return cls(status, json.dumps(data), 'application/json')
+
+async def _read_request(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError('body too large')
+    body = await reader.readexactly(length) if length else b''
+    return Request(method.upper(), target, headers, body)
+
+def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+    head = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in response.headers.items()]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body)
+
+async def serve(handler, host: str, port: int, ssl=None) -> asyncio.AbstractServer:
+    """
+    Starts a minimal HTTP/1.1 server with keep-alive. `handler(request)` is an
+    async callable returning a Response. Returns the started asyncio server.
+    """
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    _write_response(writer, Response(400, 'Bad Request'), False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                try:
+                    response = await handler(request)
+                except Exception as e:
+                    logger.exception(f"Error handling {request.method} {request.path}: {e}")
+                    response = Response(500, 'Internal Server Error')
+                _write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # Idle keep-alive connections are cancelled at shutdown. Ending quietly
+            # avoids Python 3.11's stream callback logging the cancellation as an error.
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port, ssl=ssl)
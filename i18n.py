@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import string
+import time
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages.json')
+DEFAULT_LANG = 'en'
+# How often (seconds) the file's mtime is checked for hot reload
+RELOAD_CHECK_INTERVAL = 2.0
+
+_formatter = string.Formatter()
+
+def _has_fields(template: str) -> bool:
+    return any(field is not None for _, field, _, _ in _formatter.parse(template))
+
+class Catalog:
+    """
+    messages.json compiled into one flat (lang, key) -> template table with
+    English fallbacks already applied. Templates without placeholders are
+    rendered once at load time. The file is reloaded when its mtime changes.
+    """
+
+    def __init__(self, path: str = MESSAGES_PATH):
+        self.path = path
+        self._mtime = None
+        self._checked = 0.0
+        self._templates = {}
+        self._static = {}
+        self._names = {}
+
+    def load(self):
+        """Reads and compiles the file, swapping the new tables in at once."""
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+
+        default = raw.get(DEFAULT_LANG, {})
+        keys = set().union(*(messages.keys() for messages in raw.values()))
+        templates = {}
+        static = {}
+        names = {}
+        for lang, messages in raw.items():
+            names[lang] = messages.get('language_name') or lang.upper()
+            missing = sorted(key for key in keys if not messages.get(key))
+            if missing:
+                logger.warning(f"messages.json: '{lang}' is missing {', '.join(missing)}; using '{DEFAULT_LANG}'")
+            for key in keys:
+                template = messages.get(key) or default.get(key)
+                if template is None:
+                    continue
+                templates[lang, key] = template
+                if not _has_fields(template):
+                    static[lang, key] = template.format()
+
+        self._templates, self._static, self._names = templates, static, names
+        self._mtime = mtime
+        logger.info(f"Loaded {len(templates)} messages for languages: {', '.join(names)}")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            if self._mtime != os.stat(self.path).st_mtime:
+                self.load()
+        except (OSError, ValueError) as e:
+            # Keep serving the last good catalog if an edit is mid-write or invalid
+            if self._mtime is None:
+                raise
+            logger.error(f"Could not reload {self.path}: {e}")
+
+    @property
+    def languages(self):
+        """Language codes in the order they appear in messages.json."""
+        self._refresh()
+        return list(self._names)
+
+    def language_name(self, lang: str) -> str:
+        """The language's own display name (its `language_name` message, never a fallback)."""
+        self._refresh()
+        return self._names.get(lang, lang.upper())
+
+    def _key(self, lang: str, key: str):
+        return (lang, key) if (lang, key) in self._templates else (DEFAULT_LANG, key)
+
+    def get(self, lang: str, key: str, default: str = None) -> str:
+        """Returns the raw template for a message, falling back to English."""
+        self._refresh()
+        return self._templates.get(self._key(lang, key), default)
+
+    def render(self, lang: str, key: str, default: str = "Message not found.", **params) -> str:
+        """Returns a message with its placeholders filled in."""
+        self._refresh()
+        compiled_key = self._key(lang, key)
+        text = self._static.get(compiled_key)
+        if text is not None:
+            return text
+        template = self._templates.get(compiled_key)
+        return template.format(**params) if template is not None else default
+
+catalog = Catalog()
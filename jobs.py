@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from database import (
+    get_broadcast_job, get_broadcast_jobs, iter_pending_recipients,
+    save_broadcast_progress, set_broadcast_job_status, get_failure_counts,
+    DELIVERY_SENT, DELIVERY_FAILED
+)
+from broadcast import broadcast
+from callbacks import encode
+from progress import ProgressReporter, failure_reason
+import cluster
+
+logger = logging.getLogger(__name__)
+
+# Delivery outcomes are written in batches: whichever limit is reached first.
+FLUSH_BATCH_SIZE = int(os.getenv('BROADCAST_FLUSH_BATCH', '500'))
+FLUSH_INTERVAL = float(os.getenv('BROADCAST_FLUSH_INTERVAL', '2'))
+
+# Job statuses that a worker should pick up on startup.
+ACTIVE_STATUSES = ('running',)
+# Waiting for its send time on the JobQueue
+SCHEDULED = 'scheduled'
+# Delivery raised; pending recipients stay pending until the job is resumed
+FAILED = 'failed'
+
+class JobRun:
+    """Tracks a running job's outcomes and checkpoint until they are flushed."""
+
+    def __init__(self, job_id: int, cursor: int):
+        self.job_id = job_id
+        self.cursor = cursor
+        self.stop_status = None
+        self.stopped = asyncio.Event()
+        self.flush_needed = asyncio.Event()
+        self._dispatched = deque()
+        self._settled = set()
+        self._outcomes = []
+        self._sent = 0
+        self._failed = 0
+
+    def stop(self, status: str):
+        """Stops delivery; recipients not yet sent stay pending for a resume."""
+        self.stop_status = status
+        self.stopped.set()
+
+    def dispatched(self, user_id: int):
+        self._dispatched.append(user_id)
+
+    def settled(self, user_id: int, error):
+        if error:
+            self._outcomes.append((user_id, DELIVERY_FAILED, failure_reason(error)))
+            self._failed += 1
+        else:
+            self._outcomes.append((user_id, DELIVERY_SENT, None))
+            self._sent += 1
+        self._settled.add(user_id)
+        # The cursor only moves past users whose delivery is settled, in order.
+        while self._dispatched and self._dispatched[0] in self._settled:
+            self.cursor = self._dispatched.popleft()
+            self._settled.discard(self.cursor)
+        if len(self._outcomes) >= FLUSH_BATCH_SIZE:
+            self.flush_needed.set()
+
+    async def flush(self):
+        self.flush_needed.clear()
+        if not self._outcomes:
+            return
+        outcomes, self._outcomes = self._outcomes, []
+        sent, failed, self._sent, self._failed = self._sent, self._failed, 0, 0
+        await save_broadcast_progress(self.job_id, outcomes, self.cursor, sent, failed)
+
+# job_id -> JobRun for jobs being delivered by this process
+_runs = {}
+_tasks = set()
+
+def _make_send(bot, job):
+    if job['text'] is not None:
+        return lambda user_id: bot.send_message(chat_id=user_id, text=job['text'], parse_mode='HTML')
+    return lambda user_id: bot.copy_message(
+        chat_id=user_id,
+        from_chat_id=job['from_chat_id'],
+        message_id=job['message_id'],
+        caption=job['caption']
+    )
+
+def _spread_rate(job):
+    """Messages per second that deliver a spread job's pending recipients by the end of its window."""
+    if not job['spread'] or not job['scheduled_at']:
+        return None
+    left = job['scheduled_at'] + job['spread'] - time.time()
+    pending = job['total'] - job['sent'] - job['failed']
+    if left <= 0 or pending <= 0:
+        # Past the window (e.g. after a long pause): finish at full speed
+        return None
+    return pending / left
+
+async def run_job(bot, job_id: int):
+    """Delivers a job's pending recipients, checkpointing progress as it goes."""
+    job = await get_broadcast_job(job_id)
+    if not job or job['status'] not in ACTIVE_STATUSES:
+        return
+    run = JobRun(job_id, job['cursor'])
+    _runs[job_id] = run
+
+    async def recipients():
+        async for user_id in iter_pending_recipients(job_id, job['cursor']):
+            if run.stop_status:
+                return
+            run.dispatched(user_id)
+            yield user_id
+
+    async def flusher():
+        while True:
+            try:
+                await asyncio.wait_for(run.flush_needed.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await run.flush()
+            except Exception:
+                # Sending on without checkpoints would resend everything on resume
+                run.stop(FAILED)
+                raise
+
+    reporter = None
+    if job['status_chat_id']:
+        reasons = await get_failure_counts(job_id) if job['failed'] else None
+        reporter = ProgressReporter(bot, job['status_chat_id'], job['status_message_id'],
+                                    f"Broadcasting (job #{job_id})", job['total'], job['sent'], job['failed'], reasons)
+        reporter.start()
+
+    def settled(user_id: int, error):
+        run.settled(user_id, error)
+        if reporter:
+            reporter.record(user_id, error)
+
+    flush_task = asyncio.create_task(flusher())
+    try:
+        result = await broadcast(_make_send(bot, job), recipients(), on_result=settled,
+                                 rate=_spread_rate(job), stop=run.stopped)
+    finally:
+        flush_task.cancel()
+        (flush_error,) = await asyncio.gather(flush_task, return_exceptions=True)
+        if reporter:
+            await reporter.stop()
+        try:
+            await run.flush()
+        finally:
+            del _runs[job_id]
+
+    if isinstance(flush_error, Exception):
+        raise flush_error
+    if run.stop_status == 'interrupted':
+        return
+    if not run.stop_status:
+        await set_broadcast_job_status(job_id, 'done')
+    await report_job(bot, job_id, result.rate)
+
+async def report_job(bot, job_id: int, rate: float = 0.0):
+    """Edits the job's status message with its final counts and failure reasons."""
+    job = await get_broadcast_job(job_id)
+    if not job['status_chat_id']:
+        return
+    try:
+        reasons = await get_failure_counts(job_id) if job['failed'] else None
+        reporter = ProgressReporter(bot, job['status_chat_id'], job['status_message_id'],
+                                    "", job['total'], job['sent'], job['failed'], reasons)
+        reply_markup = None
+        if job['failed']:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("📄 Failure report", callback_data=encode('job_report', job_id))
+            ]])
+        icon = "⚠️" if job['status'] == FAILED else "✅"
+        await reporter.finish(f"{icon} <b>Broadcast {job['status'].title()}</b> (job #{job_id})", rate, reply_markup)
+    except Exception as e:
+        logger.error(f"Failed to report broadcast job {job_id}: {e}")
+
+def start_job(bot, job_id: int):
+    """Starts delivering a job in the background, on the worker that owns it in cluster mode."""
+    if not cluster.owns(job_id):
+        cluster.publish('job_start', job_id=job_id)
+        return None
+    task = asyncio.create_task(_run_or_fail(bot, job_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+async def _run_or_fail(bot, job_id: int):
+    """Runs a job; if delivery raises, marks it failed so it is not resumed on every restart."""
+    try:
+        await run_job(bot, job_id)
+    except Exception:
+        logger.exception(f"Broadcast job {job_id} failed")
+        try:
+            # A pause or cancel that came first keeps its status
+            if await set_broadcast_job_status(job_id, FAILED, expected='running'):
+                await report_job(bot, job_id)
+        except Exception as e:
+            logger.error(f"Failed to mark broadcast job {job_id} as failed: {e}")
+
+async def launch_job(bot, job_queue, job_id: int):
+    """Starts a newly created job, or queues it for its send time if it is scheduled."""
+    job = await get_broadcast_job(job_id)
+    if job['status'] == SCHEDULED:
+        schedule_job(job_queue, job_id, job['scheduled_at'])
+    else:
+        start_job(bot, job_id)
+
+def schedule_job(job_queue, job_id: int, scheduled_at: int):
+    """Starts a scheduled job at its send time, on the worker that owns it in cluster mode."""
+    if not cluster.owns(job_id):
+        cluster.publish('job_schedule', job_id=job_id, scheduled_at=scheduled_at)
+        return
+    if job_queue is None:
+        raise RuntimeError("Scheduled broadcasts need the JobQueue: pip install 'python-telegram-bot[job-queue]'")
+    job_queue.run_once(_start_scheduled, max(0.0, scheduled_at - time.time()),
+                       data=job_id, name=f"broadcast-{job_id}")
+
+async def _start_scheduled(context):
+    job_id = context.job.data
+    # Skipped if the job was cancelled while it waited
+    if await set_broadcast_job_status(job_id, 'running', expected=SCHEDULED):
+        logger.info(f"Starting scheduled broadcast job {job_id}")
+        start_job(context.bot, job_id)
+
+async def schedule_pending(job_queue):
+    """Puts every scheduled job back on the JobQueue after a restart; overdue ones start at once."""
+    if job_queue is None:
+        logger.error("JobQueue unavailable (install python-telegram-bot[job-queue]); scheduled broadcasts will not start")
+        return
+    for job in await get_broadcast_jobs((SCHEDULED,), limit=-1):
+        if cluster.owns(job['job_id']):
+            schedule_job(job_queue, job['job_id'], job['scheduled_at'])
+
+async def resume_jobs(bot):
+    """Restarts every job that was still running when the process stopped."""
+    for job in await get_broadcast_jobs(ACTIVE_STATUSES, limit=-1):
+        if not cluster.owns(job['job_id']):
+            continue
+        logger.info(f"Resuming broadcast job {job['job_id']} from user {job['cursor']}")
+        start_job(bot, job['job_id'])
+
+async def pause_job(job_id: int) -> bool:
+    """Pauses a running job. Returns False if it is not running or paused."""
+    return await _stop_job(job_id, 'paused')
+
+async def cancel_job(job_id: int) -> bool:
+    """Cancels a job for good. Returns False if it is not running, paused or scheduled."""
+    return await _stop_job(job_id, 'cancelled')
+
+async def resume_job(bot, job_id: int) -> bool:
+    """Continues a paused or failed job. Returns False if the job is in any other state."""
+    job = await get_broadcast_job(job_id)
+    if not job or job['status'] not in ('paused', FAILED) or job_id in _runs:
+        return False
+    await set_broadcast_job_status(job_id, 'running')
+    start_job(bot, job_id)
+    return True
+
+async def _stop_job(job_id: int, status: str) -> bool:
+    job = await get_broadcast_job(job_id)
+    if not job or job['status'] not in ('running', 'paused', SCHEDULED):
+        return False
+    if job['status'] == SCHEDULED:
+        # Only cancelling applies; the JobQueue entry finds the job cancelled and does nothing
+        return status == 'cancelled' and await set_broadcast_job_status(job_id, status, expected=SCHEDULED)
+    await set_broadcast_job_status(job_id, status)
+    if job_id in _runs:
+        _runs[job_id].stop(status)
+    else:
+        cluster.publish('job_stop', job_id=job_id, status=status)
+    return True
+
+def _on_job_start(application, job_id):
+    if cluster.owns(job_id) and job_id not in _runs:
+        start_job(application.bot, job_id)
+
+def _on_job_stop(application, job_id, status):
+    if job_id in _runs:
+        _runs[job_id].stop(status)
+
+def _on_job_schedule(application, job_id, scheduled_at):
+    if cluster.owns(job_id):
+        schedule_job(application.job_queue, job_id, scheduled_at)
+
+cluster.subscribe('job_start', _on_job_start)
+cluster.subscribe('job_schedule', _on_job_schedule)
+cluster.subscribe('job_stop', _on_job_stop)
+
+async def stop_workers():
+    """Stops in-flight jobs without changing their status so they resume on restart."""
+    for run in _runs.values():
+        run.stop('interrupted')
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,155 @@
+"""
+End-to-end load test. Replays synthetic traffic from N users through the real
+handlers built by main.py, against fake_api.py instead of Telegram, and reports
+updates/sec and handler latency percentiles.
+
+    python loadtest.py --users 500 --admins 2 --concurrency 100 --latency 0.02 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+FAKE_API_PORT = int(os.getenv('FAKE_API_PORT', '8081'))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:LOADTEST')
+os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{FAKE_API_PORT}/bot'
+os.environ.setdefault('METRICS_PORT', '0')
+
+from telegram import Update
+
+import database
+from callbacks import encode
+import jobs
+import main
+from fake_api import FakeBotAPI
+from i18n import catalog
+
+_message_id = 0
+_bot_user = {"id": 1000000001, "is_bot": True, "first_name": "FakeBot"}
+
+def _next_message_id() -> int:
+    global _message_id
+    _message_id += 1
+    return _message_id
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+            "username": f"user{user_id}", "language_code": "en"}
+
+def message_update(user_id: int, text: str) -> dict:
+    message = {"message_id": _next_message_id(), "date": int(time.time()), "text": text,
+               "chat": {"id": user_id, "type": "private"}, "from": _user(user_id)}
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+def callback_update(user_id: int, data: str) -> dict:
+    message = {"message_id": _next_message_id(), "date": int(time.time()), "text": "menu",
+               "chat": {"id": user_id, "type": "private"}, "from": _bot_user}
+    return {"callback_query": {"id": str(_next_message_id()), "from": _user(user_id),
+                               "chat_instance": str(user_id), "data": data, "message": message}}
+
+def user_script(user_id: int):
+    """The (kind, update) sequence one regular user sends."""
+    lang = random.choice(catalog.languages)
+    return [
+        ('/start', message_update(user_id, '/start')),
+        ('/language', message_update(user_id, '/language')),
+        ('lang tap', callback_update(user_id, encode('setlang', lang))),
+        ('/remote', message_update(user_id, '/remote')),
+        ('rc_profile', callback_update(user_id, encode('rc_profile'))),
+        ('rc_lang', callback_update(user_id, encode('rc_lang'))),
+        ('rc_setlang tap', callback_update(user_id, encode('rc_setlang', lang))),
+        ('rc_status', callback_update(user_id, encode('rc_status'))),
+        ('/help', message_update(user_id, '/help')),
+        ('text', message_update(user_id, 'hello there')),
+    ]
+
+def admin_script(admin_id: int, relay_messages: int):
+    """An admin running a relay session and a one-shot broadcast."""
+    script = [('/start', message_update(admin_id, '/start')),
+              ('/sudo send -g', message_update(admin_id, '/sudo send -g all'))]
+    script += [('relay', message_update(admin_id, f'relay {i}')) for i in range(relay_messages)]
+    script += [('/sudo send -s', message_update(admin_id, '/sudo send -s')),
+               ('/sudo send -m', message_update(admin_id, '/sudo send -g all -m Load test broadcast'))]
+    return script
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    database.DB_PATH = os.path.join(workdir, 'users.db')
+    database.init_db()
+
+    api = FakeBotAPI(args.latency, args.flood_rate)
+    await api.start('127.0.0.1', FAKE_API_PORT)
+    application = main.build_application()
+    await application.initialize()
+    await main.post_init(application)
+
+    admin_ids = list(range(1, args.admins + 1))
+    user_ids = list(range(1000, 1000 + args.users))
+    for admin_id in admin_ids:
+        await database.add_admin(admin_id)
+
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def play(script):
+        async with semaphore:
+            for kind, data in script:
+                update = Update.de_json({"update_id": _next_message_id(), **data}, application.bot)
+                started = time.perf_counter()
+                # Same path as polling/webhook, so per-user ordering and limits apply
+                await application.update_processor.process_update(update, application.process_update(update))
+                latencies[kind].append(time.perf_counter() - started)
+
+    # Register everyone first so relay and broadcast traffic has an audience
+    started = time.perf_counter()
+    await asyncio.gather(*(play(user_script(u)) for u in user_ids))
+    await asyncio.gather(*(play(admin_script(a, args.relay_messages)) for a in admin_ids))
+    elapsed = time.perf_counter() - started
+    if jobs._tasks:
+        await asyncio.gather(*jobs._tasks)
+    broadcast_elapsed = time.perf_counter() - started
+
+    await main.post_stop(application)
+    await application.shutdown()
+    await api.stop()
+    database.close_db()
+
+    report(latencies, elapsed, broadcast_elapsed, api)
+
+def _percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+def report(latencies, elapsed: float, broadcast_elapsed: float, api: FakeBotAPI):
+    everything = [v for values in latencies.values() for v in values]
+    print(f"\nUpdates handled: {len(everything)} in {elapsed:.2f}s ({len(everything) / elapsed:.1f} updates/s)")
+    print(f"Including background broadcasts: {broadcast_elapsed:.2f}s\n")
+    print(f"{'update':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, values in sorted(latencies.items()) + [('ALL', everything)]:
+        p50, p95, p99 = _percentiles(values)
+        print(f"{kind:<16}{len(values):>8}{p50 * 1e3:>10.1f}{p95 * 1e3:>10.1f}{p99 * 1e3:>10.1f}")
+    print(f"\nBot API calls ({sum(api.calls.values())}, {api.floods} answered with 429):")
+    for method, count in api.calls.most_common():
+        print(f"  {method:<24}{count:>8}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test the bot's handlers against a fake Bot API.")
+    parser.add_argument('--users', type=int, default=200, help="number of synthetic users")
+    parser.add_argument('--admins', type=int, default=1, help="admins running relay sessions and broadcasts")
+    parser.add_argument('--relay-messages', type=int, default=3, help="messages each admin relays")
+    parser.add_argument('--concurrency', type=int, default=50, help="users sending at the same time")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the fake API adds per call")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of calls answered with 429")
+    # main.py configured INFO logging on import; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
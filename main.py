@@ -1,56 +1,145 @@
 from dotenv import load_dotenv
+import argparse
+import asyncio
+import hashlib
+import json
 import os
 import logging
+
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, TypeHandler
 
-from database import init_db, get_setting
+from database import init_db, get_setting, set_setting, close_db, flush_profiles, get_audience_index
 import commands
 import remote_control
 import admin
+import jobs
+import relay
+import callbacks
+import floodcontrol
+import metrics
+from update_processor import ShardedUpdateProcessor, UPDATE_CONCURRENCY
+from persistence import SQLitePersistence
 
 # Load environment variables from .env file
 load_dotenv()
 API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Optional Bot API endpoint, e.g. a local Bot API server or fake_api.py
+API_URL = os.getenv('TELEGRAM_API_URL')
+# 'polling' (default), 'webhook' or 'cluster'; can be overridden with --mode
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BOT_COMMANDS = [
+    ("start", "Start the bot & see welcome message"),
+    ("language", "Change display language"),
+    ("remote", "Open Interactive Control Panel"),
+    ("help", "Show all commands"),
+    ("broadcast", "Admin: Broadcast message (Admins only)"),
+    ("sudo", "Admin: Execute sudo commands (Admins only)"),
+]
+
+async def sync_commands(bot) -> None:
+    """Registers BOT_COMMANDS unless this bot already has exactly this list."""
+    digest = hashlib.sha256(json.dumps([bot.id, BOT_COMMANDS]).encode()).hexdigest()
+    if await get_setting("bot_commands_hash") == digest:
+        return
+    await bot.set_my_commands(BOT_COMMANDS)
+    await set_setting("bot_commands_hash", digest)
+
+def _log_audience_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception():
+        # The next broadcast tries again
+        logger.error(f"Failed to load the audience index: {task.exception()}")
+
 async def post_init(application: Application) -> None:
     """Task to run after bot initialization."""
-    await application.bot.set_my_commands([
-        ("start", "Start the bot & see welcome message"),
-        ("language", "Change display language"),
-        ("remote", "Open Interactive Control Panel"),
-        ("help", "Show all commands"),
-        ("broadcast", "Admin: Broadcast message (Admins only)"),
-        ("sudo", "Admin: Execute sudo commands (Admins only)"),
-    ])
+    await sync_commands(application.bot)
+    await relay.load_sessions()
+    # Build the audience sets in the background so the first broadcast does not wait;
+    # post_init runs before the application does, so the task is tracked here
+    loader = asyncio.create_task(get_audience_index())
+    loader.add_done_callback(_log_audience_failure)
+    application.bot_data['audience_loader'] = loader
+    application.bot_data['metrics_server'] = await metrics.start_server()
+    # Pick up broadcasts that were interrupted by the last shutdown
+    await jobs.resume_jobs(application.bot)
+    await jobs.schedule_pending(application.job_queue)
+    await floodcontrol.restore_bans(application.job_queue)
 
-def main() -> None:
-    """Initializes and runs the bot."""
-    # Ensure the database is set up
-    init_db()
+async def post_stop(application: Application) -> None:
+    """Task to run when the bot stops, before it shuts down."""
+    loader = application.bot_data.pop('audience_loader', None)
+    if loader:
+        await asyncio.gather(loader, return_exceptions=True)
+    await jobs.stop_workers()
+    await relay.stop_pipelines()
+    await flush_profiles()
 
-    # Create the Application
-    application = Application.builder().token(API_TOKEN).post_init(post_init).build()
+async def post_shutdown(application: Application) -> None:
+    """Task to run after the bot has stopped."""
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+    close_db()
+
+def build_application(mode: str = 'polling') -> Application:
+    """Creates the Application with every handler registered."""
+    builder = Application.builder().token(API_TOKEN).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    # Keeps /broadcast conversations and user_data across restarts
+    builder = builder.persistence(SQLitePersistence())
+    # Same pool sizes PTB uses by default, with every Bot API call counted and timed. Both
+    # share one TLS context, as loading the CA bundle is the slowest part of creating a client.
+    # certifi is imported here because finding its bundle takes longer than importing the bot.
+    import ssl
+    import certifi
+    tls = ssl.create_default_context(cafile=certifi.where())
+    builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=256, httpx_kwargs={'verify': tls}))
+    builder = builder.get_updates_request(metrics.InstrumentedRequest(connection_pool_size=1, httpx_kwargs={'verify': tls}))
+    if API_URL:
+        builder = builder.base_url(API_URL)
+    if UPDATE_CONCURRENCY > 1:
+        # Different users run concurrently; each user's updates stay in order
+        builder = builder.concurrent_updates(ShardedUpdateProcessor())
+    if mode == 'webhook':
+        # Updates arrive through webhook.serve(), so no getUpdates loop is needed
+        builder = builder.updater(None)
+    application = builder.build()
 
     # --- Broadcast Conversation ---
     broadcast_handler = ConversationHandler(
         entry_points=[CommandHandler("broadcast", admin.broadcast_start)],
         states={
-            admin.SELECT_TARGET: [CallbackQueryHandler(admin.receive_target, pattern="^target_")],
+            admin.SELECT_TARGET: [
+                CallbackQueryHandler(callbacks.dispatch_conversation, pattern=callbacks.pattern('target')),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin.receive_target_expression)
+            ],
             admin.SELECT_FILE: [MessageHandler(filters.ALL & ~filters.COMMAND, admin.receive_file)],
             admin.GET_CAPTION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin.receive_caption),
                 CommandHandler("skip", admin.receive_caption)
             ],
-            admin.CONFIRM_SEND: [CallbackQueryHandler(admin.admin_callback_handler, pattern="^admin_")]
+            admin.CONFIRM_SEND: [
+                CallbackQueryHandler(callbacks.dispatch_conversation, pattern=callbacks.pattern('admin_send', 'admin_schedule', 'admin_cancel'))
+            ],
+            admin.GET_SCHEDULE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin.receive_schedule)]
         },
-        fallbacks=[CommandHandler("cancel", admin.cancel)]
+        fallbacks=[CommandHandler("cancel", admin.cancel)],
+        name="broadcast",
+        persistent=True
     )
 
+    # Count every update before any other group sees it
+    application.add_handler(TypeHandler(Update, metrics.count_update), group=-100)
+    # Then drop updates from users over their rate limit, before any handler touches the database
+    application.add_handler(TypeHandler(Update, floodcontrol.limit), group=-90)
+    # Any update from a user marked unreachable brings them back into broadcasts
+    application.add_handler(TypeHandler(Update, commands.track_reachability), group=-80)
+
     # Register handlers
     application.add_handler(broadcast_handler)
     application.add_handler(CommandHandler("start", commands.start))
@@ -59,9 +148,8 @@ def main() -> None:
     application.add_handler(CommandHandler("remote", remote_control.remote_control_panel))
     application.add_handler(CommandHandler("sudo", admin.sudo_command))
     
-    # Register callback handlers
-    application.add_handler(CallbackQueryHandler(remote_control.remote_callback_handler, pattern="^(rc_|lang_)"))
-    application.add_handler(CallbackQueryHandler(commands.set_language, pattern="^(en|es|ta)$"))
+    # Every other button goes through the callback router's action table
+    application.add_handler(CallbackQueryHandler(callbacks.dispatch))
     
     # Register relay handler for admins (must be before unknown_command)
     application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, admin.relay_handler))
@@ -69,9 +157,44 @@ def main() -> None:
     # Register message handler for unknown input
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, commands.unknown_command))
 
+    metrics.instrument_application(application)
+    application.add_error_handler(metrics.on_error)
+    return application
+
+def main() -> None:
+    """Initializes and runs the bot."""
+    parser = argparse.ArgumentParser(description="Run the Telegram bot.")
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'cluster', 'worker'], default=BOT_MODE,
+                        help="how to receive updates (default: $BOT_MODE or polling); "
+                             "'worker' is started by 'cluster'")
+    parser.add_argument('--workers', type=int,
+                        help="worker processes in cluster mode (default: $CLUSTER_WORKERS or CPU count)")
+    args = parser.parse_args()
+
+    # Ensure the database is set up
+    init_db()
+
+    # Each mode imports only the modules it runs
+    if args.mode == 'cluster':
+        import cluster
+        args.workers = args.workers or cluster.CLUSTER_WORKERS
+        logger.info(f"Starting cluster supervisor with {args.workers} workers...")
+        cluster.run_supervisor(API_TOKEN, API_URL, args.workers)
+        return
+
+    # Create the Application
+    application = build_application('webhook' if args.mode == 'worker' else args.mode)
+
     # Start the bot
-    logger.info("Starting bot...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Starting bot ({args.mode})...")
+    if args.mode == 'worker':
+        import cluster
+        cluster.run_worker(application)
+    elif args.mode == 'webhook':
+        import webhook
+        webhook.run(application)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,221 @@
+import bisect
+import functools
+import logging
+import os
+import time
+from collections import deque
+
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import HTTPXRequest
+
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+# Local Prometheus endpoint; set METRICS_PORT=0 to turn it off
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# Seconds; tuned for handler and SQLite latencies
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+started_at = time.time()
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name, self.doc, self.label_names = name, doc, tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+class Gauge(Counter):
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def expose(self):
+        for line in super().expose():
+            yield line.replace(' counter', ' gauge') if line.startswith('# TYPE') else line
+
+class Histogram:
+    """Prometheus histogram that also keeps recent samples for percentiles."""
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=DEFAULT_BUCKETS, window: int = 2048):
+        self.name, self.doc, self.label_names = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0, deque(maxlen=self.window)]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+        series[3].append(value)
+
+    def percentiles(self, *quantiles, labels=None):
+        """Percentiles over the recent samples of one series, or of all series when labels is None."""
+        if labels is None:
+            samples = sorted(v for series in self._series.values() for v in series[3])
+        else:
+            samples = sorted(self._series[labels][3]) if labels in self._series else []
+        if not samples:
+            return [0.0 for _ in quantiles]
+        return [samples[min(len(samples) - 1, int(q * len(samples)))] for q in quantiles]
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count, _) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {count}"
+
+class RateMeter:
+    """Events per second over a sliding window of one-second buckets."""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._buckets = deque()
+
+    def mark(self, count: int = 1):
+        second = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([second, count])
+        self._trim(second)
+
+    def _trim(self, now: int):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def rate(self) -> float:
+        now = int(time.monotonic())
+        self._trim(now)
+        return sum(count for _, count in self._buckets) / self.window
+
+updates = Counter('bot_updates_total', 'Updates received')
+update_rate = RateMeter()
+errors = Counter('bot_errors_total', 'Exceptions raised while handling updates', ['handler'])
+handler_latency = Histogram('bot_handler_seconds', 'Handler run time', ['handler'])
+db_latency = Histogram('bot_db_query_seconds', 'Database query time', ['query'])
+api_calls = Counter('bot_api_calls_total', 'Outbound Bot API calls', ['method', 'status'])
+api_latency = Histogram('bot_api_call_seconds', 'Outbound Bot API call time', ['method'])
+broadcast_messages = Counter('bot_broadcast_messages_total', 'Broadcast deliveries', ['result'])
+broadcast_rate = Gauge('bot_broadcast_rate', 'Messages per second achieved by the last broadcast')
+delivery_rate = RateMeter()
+callback_latency = Histogram('bot_callback_seconds', 'Button handler run time', ['action'])
+callbacks_rejected = Counter('bot_callbacks_rejected_total', 'Button taps rejected before any handler ran', ['reason'])
+update_queue_depth = Gauge('bot_update_queue_depth', 'Updates running or waiting per ordering shard', ['shard'])
+updates_dropped = Counter('bot_updates_dropped_total', 'Updates dropped by flood control', ['kind'])
+flood_bans = Counter('bot_flood_bans_total', 'Users banned automatically for flooding')
+relay_queue_depth = Gauge('bot_relay_queue_depth', 'Relayed messages waiting or being delivered per relay session', ['admin'])
+
+REGISTRY = [updates, errors, handler_latency, db_latency, api_calls, api_latency,
+            broadcast_messages, broadcast_rate, callback_latency, callbacks_rejected, update_queue_depth,
+            relay_queue_depth, updates_dropped, flood_bans]
+
+def expose() -> str:
+    """Renders every metric in the Prometheus text format."""
+    lines = ["# HELP bot_uptime_seconds Seconds since start", "# TYPE bot_uptime_seconds gauge",
+             f"bot_uptime_seconds {time.time() - started_at:.0f}"]
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+def timed_handler(callback, name: str = None):
+    """Wraps a handler callback to record its latency and errors."""
+    name = name or callback.__qualname__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Flow control, e.g. from flood control, not a failure
+            raise
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+def _walk_handlers(handlers):
+    for handler in handlers:
+        # ConversationHandler keeps its own handlers in entry points, states and fallbacks
+        if hasattr(handler, 'entry_points'):
+            yield from _walk_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _walk_handlers(state_handlers)
+            yield from _walk_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+def instrument_application(application):
+    """Times every registered handler; call after all handlers are added."""
+    for group in application.handlers.values():
+        for handler in _walk_handlers(group):
+            if not getattr(handler.callback, '__wrapped__', None):
+                handler.callback = timed_handler(handler.callback)
+
+async def count_update(update, context):
+    """Registered in an early handler group so every update is counted."""
+    updates.inc()
+    update_rate.mark()
+
+async def on_error(update, context):
+    """Error handler: counts the error and logs it as PTB would without one."""
+    errors.inc('application')
+    logger.error("Exception while handling an update", exc_info=context.error)
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that counts and times every Bot API call by method."""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+            return status, payload
+        finally:
+            api_calls.inc(api_method, str(status))
+            api_latency.observe(time.perf_counter() - started, api_method)
+
+async def _handle(request: httpserver.Request) -> httpserver.Response:
+    if request.path != '/metrics':
+        return httpserver.Response(404, 'Not Found')
+    return httpserver.Response(200, expose(), 'text/plain; version=0.0.4; charset=utf-8')
+
+async def start_server():
+    """Starts the /metrics endpoint unless METRICS_PORT is 0."""
+    if not METRICS_PORT:
+        return None
+    server = await httpserver.serve(_handle, METRICS_LISTEN, METRICS_PORT)
+    logger.info(f"Metrics available at http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    return server
@@ -0,0 +1,142 @@
+"""
+SQLite-backed persistence for user_data and conversation states, so an admin
+halfway through /broadcast can carry on after a restart.
+
+Values are stored as compact JSON (handlers keep only plain fields such as
+chat and message IDs in user_data, never whole Telegram objects). PTB hands
+over every user it saw since the last run; only entries whose JSON actually
+changed are marked dirty, and all dirty entries are written in one transaction.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import get_persisted_user_data, get_persisted_conversations, save_persisted_state
+
+logger = logging.getLogger(__name__)
+
+# Seconds between PTB's persistence runs (it also runs once more on shutdown)
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '10'))
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+class SQLitePersistence(BasePersistence):
+    """Persists user_data and conversations; bot_data, chat_data and callback_data stay in memory."""
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        # Last JSON written per key, so unchanged data is never rewritten
+        self._stored_users = {}
+        self._stored_conversations = {}
+        # Changes waiting for the next flush; None means delete
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    async def get_user_data(self):
+        self._stored_users = await get_persisted_user_data()
+        return {user_id: json.loads(data) for user_id, data in self._stored_users.items()}
+
+    async def get_conversations(self, name: str):
+        stored = await get_persisted_conversations(name)
+        conversations = {}
+        for key, state in stored.items():
+            self._stored_conversations[(name, key)] = state
+            conversations[tuple(json.loads(key))] = json.loads(state)
+        return conversations
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        try:
+            encoded = _encode(data) if data else None
+        except TypeError as e:
+            logger.warning(f"Not persisting user_data of {user_id}: {e}")
+            return
+        self._mark(self._stored_users, self._dirty_users, user_id, encoded)
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        encoded = None if new_state is None else _encode(new_state)
+        self._mark(self._stored_conversations, self._dirty_conversations, (name, _encode(list(key))), encoded)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(self._stored_users, self._dirty_users, user_id, None)
+
+    def _mark(self, stored: dict, dirty: dict, key, encoded):
+        if stored.get(key) == encoded:
+            dirty.pop(key, None)
+            return
+        dirty[key] = encoded
+        # PTB calls every update_* of a run back to back, so one task writes them all
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Writes every dirty entry in one transaction."""
+        async with self._flush_lock:
+            if not self._dirty_users and not self._dirty_conversations:
+                return
+            users, self._dirty_users = self._dirty_users, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            try:
+                await save_persisted_state(
+                    list(users.items()),
+                    [(name, key, state) for (name, key), state in conversations.items()]
+                )
+            except Exception as e:
+                logger.error(f"Failed to persist {len(users)} user_data and {len(conversations)} conversation changes: {e}")
+                # Retry on the next flush unless a newer change replaced them
+                for key, value in users.items():
+                    self._dirty_users.setdefault(key, value)
+                for key, value in conversations.items():
+                    self._dirty_conversations.setdefault(key, value)
+                return
+            for key, value in users.items():
+                self._set_stored(self._stored_users, key, value)
+            for key, value in conversations.items():
+                self._set_stored(self._stored_conversations, key, value)
+
+    @staticmethod
+    def _set_stored(stored: dict, key, encoded):
+        if encoded is None:
+            stored.pop(key, None)
+        else:
+            stored[key] = encoded
+
+    # Data this bot does not persist
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
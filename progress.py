@@ -0,0 +1,179 @@
+"""
+Live broadcast progress: one status message, edited at most every
+BROADCAST_PROGRESS_INTERVAL seconds, with sent/failed/remaining counts,
+current throughput, ETA and failures by error class.
+"""
+import asyncio
+import csv
+import html
+import io
+import logging
+import os
+import time
+from collections import Counter, deque
+
+from telegram.error import RetryAfter, TelegramError
+
+from broadcast import global_bucket
+from database import iter_failed_recipients
+
+logger = logging.getLogger(__name__)
+
+# Seconds between edits of a status message; each edit also takes a token from the
+# shared send budget, so progress never slows the broadcast itself noticeably
+PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+# Throughput is measured over this many seconds of recent progress
+RATE_WINDOW = 30
+# Reasons listed in a final report message; the downloadable report has all of them
+TOP_REASONS = 5
+
+def failure_reason(error: Exception) -> str:
+    """'<ErrorClass>: <message>', e.g. 'Forbidden: bot was blocked by the user'."""
+    message = error.message if isinstance(error, TelegramError) else str(error)
+    name = type(error).__name__
+    if not message:
+        return name
+    # Some Telegram descriptions already start with the class name
+    return message if message.startswith(f"{name}:") else f"{name}: {message}"
+
+def error_class(reason: str) -> str:
+    return reason.split(':', 1)[0]
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+class ProgressReporter:
+    """Counts delivery outcomes and keeps a status message up to date with them."""
+
+    def __init__(self, bot, chat_id: int, message_id: int, title: str, total: int,
+                 sent: int = 0, failed: int = 0, reasons: dict = None, interval: float = PROGRESS_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.title = title
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.reasons = Counter(reasons or {})
+        self.interval = interval
+        self._samples = deque([(time.monotonic(), sent + failed)])
+        self._shown = None
+        self._task = None
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.sent - self.failed)
+
+    def record(self, chat_id: int, error):
+        """Broadcast on_result callback."""
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            self.reasons[failure_reason(error)] += 1
+
+    def rate(self) -> float:
+        """Deliveries per second over the last RATE_WINDOW seconds."""
+        now = time.monotonic()
+        done = self.sent + self.failed
+        self._samples.append((now, done))
+        while len(self._samples) > 2 and self._samples[0][0] < now - RATE_WINDOW:
+            self._samples.popleft()
+        started, done_then = self._samples[0]
+        return (done - done_then) / (now - started) if now > started else 0.0
+
+    def _breakdown(self, by_class: bool) -> str:
+        if not self.reasons:
+            return ""
+        if by_class:
+            counts = Counter()
+            for reason, count in self.reasons.items():
+                counts[error_class(reason)] += count
+        else:
+            counts = self.reasons
+        lines = [f"• {html.escape(reason)}: {count}" for reason, count in counts.most_common(TOP_REASONS)]
+        if len(counts) > TOP_REASONS:
+            lines.append(f"• ... {len(counts) - TOP_REASONS} more")
+        return "\n\n❌ <b>Failures</b>\n" + "\n".join(lines)
+
+    def text(self) -> str:
+        rate = self.rate()
+        eta = _format_duration(self.remaining / rate) if rate else "-"
+        return (
+            f"📤 <b>{html.escape(self.title)}</b>\n\n"
+            f"📈 Sent: {self.sent}\n"
+            f"📉 Failed: {self.failed}\n"
+            f"⏳ Remaining: {self.remaining}\n"
+            f"⚡ Speed: {rate:.1f} msg/s · ETA {eta}"
+            f"{self._breakdown(by_class=True)}"
+        )
+
+    def final_text(self, header: str, rate: float) -> str:
+        return (
+            f"{header}\n\n"
+            f"📈 Success: {self.sent}\n"
+            f"📉 Failed: {self.failed}\n"
+            f"⏳ Remaining: {self.remaining}\n"
+            f"⚡ Speed: {rate:.1f} msg/s"
+            f"{self._breakdown(by_class=False)}"
+        )
+
+    async def _edit(self, text: str, reply_markup=None) -> bool:
+        await global_bucket.acquire()
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text,
+                                             parse_mode='HTML', reply_markup=reply_markup)
+            return True
+        except RetryAfter as e:
+            # Skip this edit; the next one carries the same information
+            logger.warning(f"Progress edit rate limited for {e.retry_after}s")
+        except TelegramError as e:
+            logger.warning(f"Failed to update progress message {self.message_id}: {e}")
+        return False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            counts = (self.sent, self.failed)
+            if counts != self._shown and await self._edit(self.text()):
+                self._shown = counts
+
+    def start(self):
+        """Starts editing the status message in the background."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def finish(self, header: str, rate: float, reply_markup=None):
+        """Stops live updates and shows the final counts and failure reasons."""
+        await self.stop()
+        await self._edit(self.final_text(header, rate), reply_markup)
+
+async def failure_report(job_id: int):
+    """
+    A job's failed deliveries as CSV (user_id, error_class, reason), sorted by
+    reason. Returns (file, reason counts); the file re-imports with /sudo import.
+    """
+    data = io.BytesIO()
+    # Encodes straight into `data`, so the CSV is held once
+    text = io.TextIOWrapper(data, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(['user_id', 'error_class', 'reason'])
+    reasons = Counter()
+    # Rows arrive sorted from the database and are written as they stream
+    async for user_id, reason in iter_failed_recipients(job_id):
+        writer.writerow([user_id, error_class(reason), reason])
+        reasons[reason] += 1
+    text.detach()
+    data.seek(0)
+    data.name = f"job_{job_id}_failures.csv"
+    return data, reasons
@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import logging
+import os
+
+from telegram import ReplyParameters
+from telegram.error import TelegramError
+
+from audience import evaluate
+from database import get_relay_sessions, set_relay_session, delete_relay_session, get_audience_index
+from broadcast import broadcast
+import metrics
+import progress
+
+logger = logging.getLogger(__name__)
+
+# Relayed messages (an album counts as one) queued per session before the
+# admin's next message has to wait for room
+RELAY_QUEUE_SIZE = int(os.getenv('RELAY_QUEUE_SIZE', '20'))
+# Messages of one session delivered at the same time
+RELAY_IN_FLIGHT = int(os.getenv('RELAY_IN_FLIGHT', '3'))
+# Seconds to wait for more parts of an album after the last one arrived
+RELAY_ALBUM_WAIT = float(os.getenv('RELAY_ALBUM_WAIT', '1'))
+# Seconds shutdown waits for queued relays to go out before dropping them
+RELAY_DRAIN_TIMEOUT = float(os.getenv('RELAY_DRAIN_TIMEOUT', '30'))
+
+# admin_id -> target group for every live relay session. Mirrors the
+# relay_sessions table so the catch-all relay handler never touches the DB.
+sessions = {}
+# admin_id -> RelayPipeline, created on the first relayed message
+pipelines = {}
+_closing = set()
+
+async def load_sessions():
+    """Loads the active relay sessions from the database."""
+    sessions.clear()
+    sessions.update(await get_relay_sessions())
+
+def get_target(admin_id: int):
+    """Returns the target group of an admin's relay session, or None."""
+    return sessions.get(admin_id)
+
+async def start_session(admin_id: int, target: str):
+    """Starts (or retargets) an admin's relay session."""
+    await set_relay_session(admin_id, target)
+    sessions[admin_id] = target
+
+async def stop_session(admin_id: int) -> bool:
+    """Ends an admin's relay session. Returns True if one was active. Queued messages still go out."""
+    sessions.pop(admin_id, None)
+    pipeline = pipelines.pop(admin_id, None)
+    if pipeline:
+        task = asyncio.create_task(pipeline.close())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    return await delete_relay_session(admin_id)
+
+def get_pipeline(bot, admin_id: int) -> 'RelayPipeline':
+    """Returns the admin's relay pipeline, starting it if needed."""
+    pipeline = pipelines.get(admin_id)
+    if pipeline is None:
+        pipeline = pipelines[admin_id] = RelayPipeline(bot, admin_id)
+    return pipeline
+
+async def stop_pipelines():
+    """Lets every session deliver what it has queued, for up to RELAY_DRAIN_TIMEOUT seconds."""
+    closing = [asyncio.create_task(pipeline.close(RELAY_DRAIN_TIMEOUT)) for pipeline in pipelines.values()]
+    pipelines.clear()
+    closing += _closing
+    if closing:
+        await asyncio.gather(*closing, return_exceptions=True)
+
+class _Relay:
+    """One relayed message or album on its way to a snapshot of the audience."""
+
+    def __init__(self, chat_id: int, message_ids: list, recipients: tuple, media_group_id: str = None):
+        self.chat_id = chat_id
+        self.message_ids = message_ids
+        # Sorted and shared with the session's other relays to the same audience
+        self.recipients = recipients
+        self.media_group_id = media_group_id
+        self.deadline = 0.0
+        # One byte per recipient, by position in `recipients`
+        self._settled = bytearray(len(recipients))
+        self._released = False
+        self._waiter = None
+
+    def _position(self, user_id: int):
+        position = bisect.bisect_left(self.recipients, user_id)
+        if position < len(self.recipients) and self.recipients[position] == user_id:
+            return position
+        return None
+
+    def send(self, bot):
+        if len(self.message_ids) == 1:
+            return lambda user_id: bot.copy_message(chat_id=user_id, from_chat_id=self.chat_id,
+                                                    message_id=self.message_ids[0])
+        return lambda user_id: bot.copy_messages(chat_id=user_id, from_chat_id=self.chat_id,
+                                                 message_ids=self.message_ids)
+
+    def settled(self, user_id: int):
+        position = self._position(user_id)
+        self._settled[position] = 1
+        if self._waiter and self._waiter[0] == position and not self._waiter[1].done():
+            self._waiter[1].set_result(None)
+
+    async def wait(self, user_id: int):
+        """
+        Returns once this relay is settled for the user, or at once if they are
+        not a recipient. The next relay's recipients are produced one at a time,
+        so there is at most one waiter.
+        """
+        position = self._position(user_id)
+        if self._released or position is None or self._settled[position]:
+            return
+        self._waiter = (position, asyncio.get_running_loop().create_future())
+        try:
+            await self._waiter[1]
+        finally:
+            self._waiter = None
+
+    def release(self):
+        """Unblocks the waiter, e.g. when delivery stopped early."""
+        self._released = True
+        if self._waiter and not self._waiter[1].done():
+            self._waiter[1].set_result(None)
+
+class RelayPipeline:
+    """
+    Delivers one admin's relayed messages in the order they were sent. Up to
+    RELAY_IN_FLIGHT messages go out at once, but a recipient only gets a message
+    after the one before it was settled for them. Album parts are collected and
+    copied with one copy_messages call per recipient. When RELAY_QUEUE_SIZE
+    messages are waiting, add() waits too (after telling the admin), which holds back
+    the admin's next update.
+    """
+
+    def __init__(self, bot, admin_id: int):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.queue = asyncio.Queue(maxsize=RELAY_QUEUE_SIZE)
+        self._slots = asyncio.Semaphore(RELAY_IN_FLIGHT)
+        # Keeps puts in arrival order while the queue is full
+        self._put_lock = asyncio.Lock()
+        self._album = None
+        # (target, index version, sorted recipients) of the last audience resolved
+        self._audience = (None, None, ())
+        self._warned = False
+        self._timers = set()
+        self._deliveries = set()
+        self._task = asyncio.create_task(self._run())
+
+    async def audience(self, target: str) -> tuple:
+        """
+        The target's recipients as a sorted tuple, without banned users and the
+        admin. Re-resolved only when the target or the audience index changed, so
+        queued relays to the same audience share one tuple. Raises AudienceError.
+        """
+        index = await get_audience_index()
+        if self._audience[:2] != (target, index.version):
+            recipients = tuple(sorted(evaluate(target, index, exclude=(self.admin_id,))))
+            self._audience = (target, index.version, recipients)
+        return self._audience[2]
+
+    async def add(self, message, recipients: tuple):
+        """Queues a message for `recipients` (from audience()); album parts are held until the album is complete."""
+        loop = asyncio.get_running_loop()
+        if message.media_group_id:
+            album = self._album
+            if album is None or album.media_group_id != message.media_group_id:
+                await self._flush_album()
+                album = self._album = _Relay(message.chat_id, [], recipients, message.media_group_id)
+                timer = asyncio.create_task(self._album_timeout(album))
+                self._timers.add(timer)
+                timer.add_done_callback(self._timers.discard)
+            album.message_ids.append(message.message_id)
+            album.deadline = loop.time() + RELAY_ALBUM_WAIT
+            return
+        await self._flush_album()
+        await self._put(_Relay(message.chat_id, [message.message_id], recipients))
+
+    async def _album_timeout(self, album: _Relay):
+        loop = asyncio.get_running_loop()
+        while (delay := album.deadline - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        if self._album is album:
+            await self._flush_album()
+
+    async def _flush_album(self):
+        album, self._album = self._album, None
+        if album:
+            # copy_messages needs increasing IDs; they also give the album's original order
+            album.message_ids.sort()
+            await self._put(album)
+
+    async def _put(self, relay):
+        async with self._put_lock:
+            if not self.queue.full():
+                self._warned = False
+            elif not self._warned:
+                self._warned = True
+                try:
+                    await self.bot.send_message(
+                        chat_id=self.admin_id,
+                        text="⏳ Relay queue is full; your next messages go out once earlier ones are delivered."
+                    )
+                except TelegramError as e:
+                    logger.warning(f"Failed to warn {self.admin_id} about a full relay queue: {e}")
+            await self.queue.put(relay)
+        self._update_depth()
+
+    def _update_depth(self):
+        metrics.relay_queue_depth.set(self.queue.qsize() + len(self._deliveries), self.admin_id)
+
+    async def _run(self):
+        previous = None
+        while True:
+            relay = await self.queue.get()
+            if relay is None:
+                break
+            await self._slots.acquire()
+            task = asyncio.create_task(self._deliver(relay, previous))
+            self._deliveries.add(task)
+            task.add_done_callback(self._delivered)
+            previous = relay
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    def _delivered(self, task):
+        self._deliveries.discard(task)
+        self._update_depth()
+
+    async def _deliver(self, relay: _Relay, previous: _Relay):
+        reporter = None
+        try:
+            try:
+                # Progress goes to a reply to the relayed message
+                status_msg = await self.bot.send_message(
+                    chat_id=self.admin_id, text=f"📡 Relaying to {len(relay.recipients)} users...",
+                    reply_parameters=ReplyParameters(relay.message_ids[0], allow_sending_without_reply=True)
+                )
+                reporter = progress.ProgressReporter(self.bot, status_msg.chat_id, status_msg.message_id,
+                                                     "Relaying", len(relay.recipients))
+                reporter.start()
+            except TelegramError as e:
+                logger.warning(f"Failed to send relay status to {self.admin_id}: {e}")
+
+            async def recipients():
+                for user_id in relay.recipients:
+                    if previous:
+                        await previous.wait(user_id)
+                    yield user_id
+
+            def settled(user_id: int, error):
+                relay.settled(user_id)
+                if reporter:
+                    reporter.record(user_id, error)
+
+            result = await broadcast(relay.send(self.bot), recipients(), on_result=settled)
+            if reporter:
+                album = f" album of {len(relay.message_ids)}" if len(relay.message_ids) > 1 else ""
+                await reporter.finish(f"📡 <b>Relayed{album}</b>", result.rate)
+        except Exception as e:
+            logger.error(f"Relay from {self.admin_id} failed: {e}")
+        finally:
+            if reporter:
+                await reporter.stop()
+            relay.release()
+            self._slots.release()
+
+    async def close(self, timeout: float = None):
+        """Delivers everything queued, then stops. Gives up after `timeout` seconds."""
+        await self._flush_album()
+        async with self._put_lock:
+            await self.queue.put(None)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            dropped = self.queue.qsize() + len(self._deliveries)
+            logger.warning(f"Dropping {dropped} relayed messages from {self.admin_id} that were still going out")
+            self._task.cancel()
+            for task in list(self._deliveries):
+                task.cancel()
+        metrics.relay_queue_depth.set(0, self.admin_id)
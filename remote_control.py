@@ -1,8 +1,15 @@
+import time
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import get_user_language, update_user_language, get_user_profile
-from commands import get_message
+from commands import language_buttons
+from i18n import catalog
+from callbacks import encode, route
+import metrics
+from update_processor import ShardedUpdateProcessor
 
+@route('rc_main')
 async def remote_control_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Shows the Remote Control dashboard."""
     user = update.effective_user
@@ -11,21 +18,54 @@ async def remote_control_panel(update: Update, context: ContextTypes.DEFAULT_TYP
     text = "🎮 <b>Remote Control Panel</b>\nSelect an option below:"
     
     keyboard = [
-        [InlineKeyboardButton("👤 My Profile", callback_data="rc_profile")],
-        [InlineKeyboardButton("🌐 Change Language", callback_data="rc_lang")],
-        [InlineKeyboardButton("📊 Bot Status", callback_data="rc_status")],
-        [InlineKeyboardButton("❌ Close", callback_data="rc_close")]
+        [InlineKeyboardButton("👤 My Profile", callback_data=encode('rc_profile'))],
+        [InlineKeyboardButton("🌐 Change Language", callback_data=encode('rc_lang'))],
+        [InlineKeyboardButton("📊 Bot Status", callback_data=encode('rc_status'))],
+        [InlineKeyboardButton("❌ Close", callback_data=encode('rc_close'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if update.callback_query:
+        await update.callback_query.answer()
         await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
     else:
         await update.message.reply_html(text, reply_markup=reply_markup)
 
+def _format_uptime(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours:02d}h {minutes:02d}m" if days else f"{hours:02d}h {minutes:02d}m {seconds:02d}s"
+
+def _format_backlog(processor) -> str:
+    if not isinstance(processor, ShardedUpdateProcessor):
+        return ""
+    busiest = ", ".join(f"#{shard}: {depth}" for shard, depth in processor.busiest_shards())
+    return f"🧵 In flight: {processor.current_concurrent_updates} (busiest shards {busiest or '-'})\n"
+
+def build_status_text(processor=None) -> str:
+    """Live bot status from the metrics registry."""
+    p50, p95, p99 = metrics.db_latency.percentiles(0.5, 0.95, 0.99)
+    api_errors = sum(count for (method, status), count in metrics.api_calls.values.items() if status != '200')
+    return (
+        "✨ <b>Bot Status</b>\n\n"
+        f"🕒 Uptime: {_format_uptime(time.time() - metrics.started_at)}\n"
+        f"📥 Updates: {metrics.updates.total():.0f} ({metrics.update_rate.rate():.2f}/s, last minute)\n"
+        f"{_format_backlog(processor)}"
+        f"⚠️ Errors: {metrics.errors.total():.0f}\n"
+        f"🗄 DB latency: p50 {p50 * 1e3:.1f} ms · p95 {p95 * 1e3:.1f} ms · p99 {p99 * 1e3:.1f} ms\n"
+        f"📡 API calls: {metrics.api_calls.total():.0f} ({api_errors:.0f} failed)\n"
+        f"📢 Broadcast: {metrics.delivery_rate.rate():.1f} msg/s now, "
+        f"last run {metrics.broadcast_rate.values.get((), 0.0):.1f} msg/s, "
+        f"{metrics.broadcast_messages.values.get(('sent',), 0):.0f} sent / "
+        f"{metrics.broadcast_messages.values.get(('failed',), 0):.0f} failed"
+    )
+
+@route('rc_profile')
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Shows the user's stored profile information."""
     query = update.callback_query
+    await query.answer()
     user_id = query.from_user.id
     profile = await get_user_profile(user_id)
     
@@ -41,49 +81,48 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     else:
         text = "❌ Profile not found."
 
-    keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="rc_main")]]
+    keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data=encode('rc_main'))]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@route('rc_lang')
 async def change_language_method(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Shows the language selection menu within the remote control."""
     query = update.callback_query
+    await query.answer()
     user = query.from_user
     lang = await get_user_language(user.id)
     
-    text = get_message(lang, 'language_select')
+    text = catalog.render(lang, 'language_select')
     
-    keyboard = [
-        [InlineKeyboardButton("🇺🇸 English", callback_data="lang_en"), 
-         InlineKeyboardButton("🇪🇸 Español", callback_data="lang_es"),
-         InlineKeyboardButton("🇮🇳 தமிழ்", callback_data="lang_ta")],
-        [InlineKeyboardButton("🔙 Back to Menu", callback_data="rc_main")]
+    keyboard = language_buttons('rc_setlang') + [
+        [InlineKeyboardButton("🔙 Back to Menu", callback_data=encode('rc_main'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
 
-async def remote_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Router for all remote control related callbacks."""
+@route('rc_status')
+async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows live bot metrics."""
+    query = update.callback_query
+    await query.answer()
+    status_text = build_status_text(context.application.update_processor)
+    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data=encode('rc_main'))]]
+    await query.edit_message_text(status_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+@route('rc_close')
+async def close_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Removes the control panel message."""
+    await update.callback_query.answer()
+    await update.callback_query.delete_message()
+
+@route('rc_setlang', args=1)
+async def set_language_from_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stores the language picked in the control panel."""
     query = update.callback_query
-    data = query.data
     await query.answer()
+    new_lang = context.args[0]
+    await update_user_language(query.from_user.id, new_lang)
     
-    if data == "rc_main":
-        await remote_control_panel(update, context)
-    elif data == "rc_profile":
-        await show_profile(update, context)
-    elif data == "rc_lang":
-        await change_language_method(update, context)
-    elif data == "rc_status":
-        status_text = "✨ <b>Bot Status</b>\n\n✅ Database: Connected\n✅ Polling: Active\n🕒 Uptime: Running"
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="rc_main")]]
-        await query.edit_message_text(status_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
-    elif data == "rc_close":
-        await query.delete_message()
-    elif data.startswith("lang_"):
-        new_lang = data.split("_")[1]
-        user_id = query.from_user.id
-        await update_user_language(user_id, new_lang)
-        
-        success_msg = get_message(new_lang, 'language_changed').format(language=new_lang.upper())
-        keyboard = [[InlineKeyboardButton("🏠 Back to Control Panel", callback_data="rc_main")]]
-        await query.edit_message_text(success_msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    success_msg = catalog.render(new_lang, 'language_changed', language=new_lang.upper())
+    keyboard = [[InlineKeyboardButton("🏠 Back to Control Panel", callback_data=encode('rc_main'))]]
+    await query.edit_message_text(success_msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
@@ -0,0 +1,81 @@
+"""
+Send times and spread windows for scheduled broadcasts, as admins type them:
+
+    when:    now | +30m | +2h | +1h30m | 21:30 | 2026-10-18T09:00   (server time)
+    spread:  45s | 90m | 2h | 1h30m | 1d
+
+A spread delivers the broadcast evenly over that window instead of at full speed.
+"""
+import re
+import time
+from datetime import datetime, timedelta
+
+_DURATION = re.compile(r'(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?')
+_CLOCK = re.compile(r'(\d{1,2}):(\d{2})')
+
+# Longest accepted delay or spread window
+MAX_AHEAD = timedelta(days=30)
+
+class ScheduleError(ValueError):
+    """Raised for a send time or spread window that cannot be parsed."""
+
+def parse_duration(text: str) -> int:
+    """'1h30m' -> 5400 seconds."""
+    match = _DURATION.fullmatch(text.strip().lower())
+    if not text.strip() or not match or not any(match.groups()):
+        raise ScheduleError(f"'{text}' is not a duration like 90m, 2h or 1h30m")
+    days, hours, minutes, seconds = (int(value or 0) for value in match.groups())
+    duration = timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+    if duration > MAX_AHEAD:
+        raise ScheduleError(f"'{text}' is longer than {MAX_AHEAD.days} days")
+    return int(duration.total_seconds())
+
+def parse_when(text: str, now: datetime = None) -> datetime:
+    """A send time; clock times mean their next occurrence. Returns a timezone-aware datetime."""
+    now = now or datetime.now().astimezone()
+    text = text.strip()
+    if text.lower() == 'now':
+        return now
+    if text.startswith('+'):
+        return now + timedelta(seconds=parse_duration(text[1:]))
+    clock = _CLOCK.fullmatch(text)
+    if clock:
+        hour, minute = int(clock.group(1)), int(clock.group(2))
+        if hour > 23 or minute > 59:
+            raise ScheduleError(f"'{text}' is not a valid time of day")
+        when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return when if when > now else when + timedelta(days=1)
+    try:
+        when = datetime.fromisoformat(text)
+    except ValueError:
+        raise ScheduleError(f"'{text}' is not a time like now, +2h, 21:30 or 2026-10-18T09:00") from None
+    when = when.astimezone() if when.tzinfo is None else when
+    if when < now - timedelta(minutes=1):
+        raise ScheduleError(f"{text} is in the past")
+    if when - now > MAX_AHEAD:
+        raise ScheduleError(f"{text} is more than {MAX_AHEAD.days} days ahead")
+    return when
+
+def parse_schedule(text: str, now: datetime = None) -> tuple:
+    """'<when> [<spread>]' -> (epoch seconds, spread seconds)."""
+    parts = text.split()
+    if not parts or len(parts) > 2:
+        raise ScheduleError("Send a time and optionally a spread window, e.g. 21:30 2h")
+    when = parse_when(parts[0], now)
+    spread = parse_duration(parts[1]) if len(parts) == 2 else 0
+    return int(when.timestamp()), spread
+
+def format_duration(seconds: int) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    text = "".join(f"{value}{unit}" for value, unit in ((hours, 'h'), (minutes, 'm'), (seconds, 's')) if value)
+    return text or "0s"
+
+def describe(scheduled_at: int, spread: int = 0) -> str:
+    """e.g. 'at 2026-10-17 21:30, spread over 2h'."""
+    text = ""
+    if scheduled_at and scheduled_at > time.time():
+        text = f"at {datetime.fromtimestamp(scheduled_at).strftime('%Y-%m-%d %H:%M')}"
+    if spread:
+        text += f"{', ' if text else ''}spread over {format_duration(spread)}"
+    return text or "now"
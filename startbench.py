@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark. Starts the bot in fresh interpreters against fake_api.py,
+first on a new database and then again on the same one (a restart), and
+reports import time, time until the bot is ready and time to the first
+handled update, with the Bot API calls each start made.
+
+    python startbench.py --latency 0.05 --restarts 3
+"""
+import time
+
+_started = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+FAKE_API_PORT = int(os.getenv('FAKE_API_PORT', '8081'))
+
+async def child(db_path: str):
+    """One start, timed from interpreter start to the first update handled."""
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{FAKE_API_PORT}/bot'
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:STARTBENCH')
+    os.environ.setdefault('METRICS_PORT', '0')
+    before_import = time.perf_counter()
+    import main
+    import database
+    from telegram import Update
+    timings = {'import': time.perf_counter() - before_import}
+
+    mark = time.perf_counter()
+    database.DB_PATH = db_path
+    database.init_db()
+    timings['init_db'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    application = main.build_application()
+    await application.initialize()
+    await main.post_init(application)
+    timings['ready'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    update = Update.de_json({"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "text": "/start",
+        "chat": {"id": 1000, "type": "private"},
+        "from": {"id": 1000, "is_bot": False, "first_name": "Bench", "language_code": "en"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}, application.bot)
+    await application.process_update(update)
+    timings['first_update'] = time.perf_counter() - mark
+    timings['total'] = time.perf_counter() - _started
+
+    await main.post_stop(application)
+    await application.shutdown()
+    await main.post_shutdown(application)
+    print(json.dumps(timings))
+
+async def run(args):
+    from fake_api import FakeBotAPI
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='startbench-'), 'users.db')
+    api = FakeBotAPI(args.latency)
+    await api.start('127.0.0.1', FAKE_API_PORT)
+    print(f"{'start':<12}{'process':>9}{'import':>9}{'init_db':>9}{'ready':>9}{'1st upd':>9}{'total':>9}   API calls")
+    try:
+        for run_number in range(args.restarts + 1):
+            calls_before = api.calls.copy()
+            spawned = time.perf_counter()
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), '--child', db_path,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            out, _ = await proc.communicate()
+            wall = time.perf_counter() - spawned
+            if proc.returncode:
+                raise SystemExit(f"Child start failed with exit code {proc.returncode}")
+            t = json.loads(out.decode().strip().splitlines()[-1])
+            calls = ', '.join(f"{m} {c}" for m, c in (api.calls - calls_before).items())
+            label = 'new db' if run_number == 0 else f'restart {run_number}'
+            print(f"{label:<12}{wall * 1e3:>9.0f}{t['import'] * 1e3:>9.0f}{t['init_db'] * 1e3:>9.1f}"
+                  f"{t['ready'] * 1e3:>9.0f}{t['first_update'] * 1e3:>9.0f}{t['total'] * 1e3:>9.0f}   {calls}")
+    finally:
+        await api.stop()
+    print("\nms; 'process' includes interpreter start-up and shutdown, 'total' is interpreter start to first update.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure how fast the bot starts and handles its first update.")
+    parser.add_argument('--child', metavar='DB', help=argparse.SUPPRESS)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds the fake API adds per call")
+    parser.add_argument('--restarts', type=int, default=2, help="starts on the existing database after the first")
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(args.child))
+    else:
+        asyncio.run(run(args))
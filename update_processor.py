@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Updates handled at the same time across all users
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))
+# Updates accepted (running or waiting for their shard) before the fetcher backs off
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '4096'))
+# Users and chats are hashed onto this many ordered shards
+UPDATE_SHARDS = int(os.getenv('UPDATE_SHARDS', '128'))
+
+def ordering_key(update: object):
+    """The user (or, failing that, chat) whose updates must stay in order. None if unordered."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+class ShardedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different users concurrently while each user's
+    updates run strictly in arrival order. Every user maps to one shard; a
+    shard runs one update at a time, FIFO, and at most `concurrency` shards run
+    at once.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, shards: int = UPDATE_SHARDS,
+                 max_pending: int = UPDATE_MAX_PENDING):
+        # PTB's own semaphore bounds accepted updates; ours bounds running ones
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.shards = shards
+        self._running = asyncio.Semaphore(concurrency)
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+        self.depth = [0] * shards
+
+    def shard_of(self, update: object):
+        key = ordering_key(update)
+        return None if key is None else hash(key) % self.shards
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        shard = self.shard_of(update)
+        if shard is None:
+            async with self._running:
+                await coroutine
+            return
+
+        self.depth[shard] += 1
+        metrics.update_queue_depth.set(self.depth[shard], shard)
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps per-user order
+            async with self._locks[shard]:
+                async with self._running:
+                    await coroutine
+        finally:
+            self.depth[shard] -= 1
+            metrics.update_queue_depth.set(self.depth[shard], shard)
+
+    def busiest_shards(self, count: int = 3):
+        """(shard, depth) pairs for the deepest non-empty shards."""
+        ranked = sorted(((depth, shard) for shard, depth in enumerate(self.depth) if depth), reverse=True)
+        return [(shard, depth) for depth, shard in ranked[:count]]
+
+    async def initialize(self) -> None:
+        logger.info(f"Processing updates concurrently: {self.concurrency} at a time over {self.shards} ordered shards")
+
+    async def shutdown(self) -> None:
+        pass
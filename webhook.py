@@ -0,0 +1,103 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+import ssl
+
+from telegram import Update
+
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS URL Telegram should call. Leave empty to skip setWebhook, e.g.
+# when the webhook is managed elsewhere or when testing offline.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Only needed when Telegram connects to this process directly. Behind a
+# TLS-terminating proxy, leave these empty and listen on plain HTTP.
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT', '')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY', '')
+
+def make_handler(application, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+    """Returns the HTTP handler that checks, parses and queues incoming updates."""
+    async def handle(request: httpserver.Request) -> httpserver.Response:
+        if request.path != path:
+            return httpserver.Response(404, 'Not Found')
+        if request.method != 'POST':
+            return httpserver.Response(405, 'Method Not Allowed')
+        if secret:
+            token = request.headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(token.encode(), secret.encode()):
+                return httpserver.Response(403, 'Forbidden')
+        try:
+            update = Update.de_json(request.json(), application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            return httpserver.Response(400, 'Bad Request')
+        await application.update_queue.put(update)
+        return httpserver.Response(200, 'OK')
+    return handle
+
+def _ssl_context():
+    if not WEBHOOK_CERT:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY or None)
+    return context
+
+async def serve(application, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT, handler=None,
+                url: str = WEBHOOK_URL, tls: bool = True):
+    """
+    Runs the application on the embedded webhook server until SIGINT/SIGTERM.
+    `handler` replaces the default update handler; setWebhook is skipped without `url`.
+    `tls=False` serves plain HTTP even when WEBHOOK_CERT is set.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    server = None
+    try:
+        if url:
+            certificate = open(WEBHOOK_CERT, 'rb') if WEBHOOK_CERT else None
+            try:
+                await application.bot.set_webhook(
+                    url=url,
+                    secret_token=WEBHOOK_SECRET or None,
+                    certificate=certificate,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            finally:
+                if certificate:
+                    certificate.close()
+        server = await httpserver.serve(handler or make_handler(application), listen, port, _ssl_context() if tls else None)
+        await application.start()
+        logger.info(f"Webhook server listening on {listen}:{port}")
+        await stop.wait()
+    finally:
+        if server:
+            server.close()
+            await server.wait_closed()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run(application):
+    """Blocking entry point, the webhook counterpart of application.run_polling()."""
+    asyncio.run(serve(application))